@@ -1,12 +1,15 @@
 import streamlit as st
+import asyncio
+import hashlib
+import importlib
 import os
 import io
-import base64
+import threading
 import time
-from PIL import Image
-import google.generativeai as genai
-from src.image_utils import ImageProcessor
-from src.dress_synthesizer import DressSynthesizer
+# Only light modules load up front; Pillow, NumPy, the try-on engine and the
+# Gemini SDK are imported on first use so the UI shell renders first
+from src.quality import DEFAULT_QUALITY, QUALITY_PROFILES
+from src.metrics import METRICS
 from src.styles import get_custom_css, get_success_message_html, get_tips_html, get_feature_cards_html
 
 # Load environment variables
@@ -28,9 +31,8 @@ st.set_page_config(
 st.markdown(get_custom_css(), unsafe_allow_html=True)
 
 # Initialize the AI components
-@st.cache_resource
-def initialize_ai():
-    """Initialize the Gemini AI model"""
+def get_api_key():
+    """Return the Gemini API key, or explain how to configure it and stop"""
     # Get API key from Streamlit secrets or environment variables
     api_key = None
     
@@ -51,9 +53,279 @@ def initialize_ai():
         """)
         st.stop()
     
+    return api_key
+
+@st.cache_resource
+def initialize_ai(api_key):
+    """Initialize the Gemini AI model"""
+    import google.generativeai as genai
+    
     genai.configure(api_key=api_key)
     return genai.GenerativeModel('gemini-1.5-flash')
 
+@st.cache_resource
+def warm_up_imports():
+    """Load the try-on engine and the Gemini SDK in the background once the UI is up"""
+    def load():
+        for module in ("src.dress_synthesizer", "google.generativeai"):
+            try:
+                importlib.import_module(module)
+            except ImportError:
+                pass  # Surfaces with a proper message when the module is actually used
+    
+    thread = threading.Thread(target=load, name="import-warmup", daemon=True)
+    thread.start()
+    return thread
+
+@st.cache_resource
+def initialize_cache():
+    """Create the analysis result cache shared by all sessions"""
+    from src.cache import ResultCache
+    
+    return ResultCache(
+        max_entries=256,
+        cache_dir=os.path.join(".cache", "gemini"),
+        max_disk_bytes=50 * 1024 * 1024
+    )
+
+@st.cache_resource
+def initialize_image_store():
+    """Create the store that uploads each distinct image to Gemini only once"""
+    from src.image_handles import ImageHandleStore, gemini_uploader
+    
+    return ImageHandleStore(uploader=gemini_uploader)
+
+@st.cache_resource
+def initialize_resilience():
+    """Create the retry/hedging policy and circuit breaker shared by all sessions"""
+    from src.resilience import ResiliencePolicy
+    
+    return ResiliencePolicy()
+
+def create_image_processor(quality):
+    """Create the image processor for a quality profile"""
+    from src.image_utils import ImageProcessor
+    
+    return ImageProcessor(quality=quality)
+
+def create_synthesizer(api_key, quality, analysis_mode):
+    """Create the try-on engine; this is where the Gemini SDK is first needed"""
+    from src.dress_synthesizer import DressSynthesizer
+    
+    return DressSynthesizer(
+        initialize_ai(api_key),
+        cache=initialize_cache(),
+        image_store=initialize_image_store(),
+        quality=quality,
+        resilience=initialize_resilience(),
+        analysis_mode=analysis_mode
+    )
+
+# Width the upload previews are downscaled to before being sent to the browser
+PREVIEW_WIDTH = 640
+
+def get_upload_images(upload, purpose, quality):
+    """
+    Return the session's memo entry for an upload: the decoded image, a
+    display-sized preview and, once requested, the preprocessed image.
+    Entries are keyed by the upload's content hash and the quality profile,
+    so reruns that don't change the upload skip all image work.
+    """
+    memo = st.session_state.setdefault("upload_images", {})
+    entry = memo.get(purpose)
+    file_id = getattr(upload, "file_id", None)
+    if entry is not None and file_id is not None and entry["file_id"] == file_id \
+            and entry["quality"] == quality:
+        return entry
+    
+    digest = hashlib.sha256(upload.getvalue()).hexdigest()
+    if entry is not None and entry["digest"] == digest and entry["quality"] == quality:
+        entry["file_id"] = file_id
+        return entry
+    
+    # Decode at reduced scale; validation happens in the same pass. Only the
+    # latest upload per slot is kept, replacing the previous one.
+    image_processor = create_image_processor(quality)
+    image, message = image_processor.load_image(upload, purpose=purpose)
+    entry = {
+        "purpose": purpose,
+        "file_id": file_id,
+        "digest": digest,
+        "quality": quality,
+        "image": image,
+        "message": message,
+        "display": image_processor.resize_for_display(image, PREVIEW_WIDTH) if image is not None else None,
+        "processed": None,
+    }
+    memo[purpose] = entry
+    return entry
+
+def get_processed_image(entry):
+    """Return the preprocessed image for a memo entry, computing it on first use"""
+    if entry["processed"] is None:
+        image_processor = create_image_processor(entry["quality"])
+        if entry["purpose"] == "human":
+            entry["processed"] = image_processor.preprocess_human_image(entry["image"])
+        else:
+            entry["processed"] = image_processor.preprocess_dress_image(entry["image"])
+    return entry["processed"]
+
+async def stream_text_into(placeholder, chunks):
+    """Render streamed Markdown text into a placeholder as it arrives"""
+    text = ""
+    async for chunk in chunks:
+        text += chunk
+        placeholder.markdown(text)
+    return text
+
+async def stream_try_on_into(events, image_placeholder, live_placeholder, progress_bar, status_text):
+    """
+    Render try-on stream events (live analysis text and previews).
+    Returns (final image, error message or None).
+    """
+    live_text = ""
+    result_image = None
+    error = None
+    async for event, payload in events:
+        if event in ('analysis', 'visualization'):
+            live_text += payload
+            live_placeholder.caption(live_text)
+        elif event == 'preview':
+            progress_bar.progress(70)
+            status_text.text("✨ Refining your try-on...")
+            image_placeholder.image(payload, caption="Preview", use_container_width=True)
+        elif event == 'error':
+            error = payload
+        elif event == 'result':
+            result_image = payload
+    return result_image, error
+
+# Analyses shown in the result tabs: (button label, streaming synthesizer method)
+ANALYSES = {
+    'compatibility': ("🔍 Analyze Style Compatibility", 'stream_compatibility_async'),
+    'styling': ("💄 Get Styling Suggestions", 'stream_styling_suggestions_async'),
+}
+# Prefixes of the text the synthesizer returns when an analysis fails
+UNAVAILABLE_PREFIXES = ("Analysis unavailable", "Suggestions unavailable")
+
+def render_analysis(kind, pair, load_inputs):
+    """
+    Show an analysis for the current person/dress pair. It only runs when
+    asked for, and is kept in session state so it survives reruns.
+    """
+    results = st.session_state.setdefault("analysis_results", {})
+    key = (kind,) + pair
+    if key in results:
+        st.markdown(results[key])
+        return
+    
+    label, method = ANALYSES[kind]
+    if st.button(label, key=f"run_{kind}", use_container_width=True):
+        placeholder = st.empty()
+        with st.spinner("Analyzing..."):
+            processed_human, processed_dress, dress_synthesizer = load_inputs()
+            text = asyncio.run(stream_text_into(
+                placeholder, getattr(dress_synthesizer, method)(processed_human, processed_dress)
+            ))
+        # Failures are not kept, so the button stays available for a retry
+        if not text.startswith(UNAVAILABLE_PREFIXES):
+            results[key] = text
+
+def render_try_on_result(result, enable_analysis, load_inputs):
+    """Render a finished try-on with its download and the on-demand analysis tabs"""
+    st.markdown(get_success_message_html(), unsafe_allow_html=True)
+    
+    # Display result in styled container
+    st.markdown("""
+    <div class="result-section">
+        <h2 style="color: #2C3E50; text-align: center; margin-bottom: 1rem;">
+            🎉 Your Virtual Try-On Result
+        </h2>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    # Create tabs for different views
+    tab1, tab2, tab3 = st.tabs(["🖼️ Result", "📊 Analysis", "💡 Styling Tips"])
+    
+    with tab1:
+        if result["error"]:
+            st.error(result["error"])
+        st.image(result["image"], caption="Virtual Try-On Result", use_container_width=True)
+        
+        # Download section
+        col_download1, col_download2 = st.columns([2, 1])
+        with col_download1:
+            st.download_button(
+                label="💾 Download High Quality",
+                data=result["png"],
+                file_name=f"virtual_try_on_{result['timestamp']}.png",
+                mime="image/png",
+                use_container_width=True
+            )
+        
+        with col_download2:
+            st.info(f"💾 Saved to: {result['output_path']}")
+    
+    with tab2:
+        if enable_analysis:
+            st.markdown("### 🔍 Style Analysis")
+            render_analysis('compatibility', result["pair"], load_inputs)
+        else:
+            st.info("Style analysis is disabled. Enable it in Advanced Options (not available in Fast mode).")
+    
+    with tab3:
+        if enable_analysis:
+            st.markdown("### 💄 Styling Suggestions")
+            render_analysis('styling', result["pair"], load_inputs)
+        else:
+            st.info("Styling suggestions require style analysis to be enabled.")
+
+def format_rate(value):
+    return "–" if value is None else f"{value:.0%}"
+
+def format_bytes(value):
+    for unit in ("B", "KB", "MB"):
+        if value < 1024:
+            return f"{value:.0f} {unit}"
+        value /= 1024
+    return f"{value:.1f} GB"
+
+def render_metrics(metrics):
+    """Show live runtime metrics for this server process"""
+    col_stat1, col_stat2 = st.columns(2)
+    with col_stat1:
+        st.metric("Try-ons Generated", f"{metrics.counter_value('tryon_results_total'):,}")
+        st.metric("Cache Hit Rate", format_rate(metrics.ratio('cache_requests_total', {'result': 'hit'})))
+    with col_stat2:
+        st.metric("Fallback Rate", format_rate(metrics.ratio('tryon_results_total', {'path': 'fallback'})))
+        st.metric("Sent to AI", format_bytes(metrics.counter_value('model_request_bytes_total')))
+    
+    with st.expander("⏱️ Where the time goes"):
+        snapshot = metrics.snapshot()
+        rows = [
+            {
+                "Span": ("AI " if histogram['name'] == 'model_call_seconds' else "")
+                        + "/".join(histogram['labels'].values()),
+                "Count": histogram['count'],
+                "p50 (ms)": round(histogram['quantiles']['0.5'] * 1000, 1),
+                "p95 (ms)": round(histogram['quantiles']['0.95'] * 1000, 1),
+                "p99 (ms)": round(histogram['quantiles']['0.99'] * 1000, 1),
+            }
+            for histogram in snapshot['histograms']
+        ]
+        if rows:
+            st.dataframe(rows, hide_index=True, use_container_width=True)
+        else:
+            st.caption("No requests measured yet.")
+        
+        col_export1, col_export2 = st.columns(2)
+        with col_export1:
+            st.download_button("Prometheus", metrics.to_prometheus(), file_name="metrics.prom",
+                               mime="text/plain", use_container_width=True)
+        with col_export2:
+            st.download_button("JSON", metrics.to_json(), file_name="metrics.json",
+                               mime="application/json", use_container_width=True)
+
 def main():
     # Header section with custom styling
     st.markdown("""
@@ -68,10 +340,11 @@ def main():
     # Feature cards
     st.markdown(get_feature_cards_html(), unsafe_allow_html=True)
     
-    # Initialize AI model
-    model = initialize_ai()
-    image_processor = ImageProcessor()
-    dress_synthesizer = DressSynthesizer(model)
+    # Check the API key up front; the model itself is created on first use
+    api_key = get_api_key()
+    # The quality slider is rendered below the uploads, but uploads are
+    # decoded for the working size of the selected profile
+    selected_quality = st.session_state.get("output_quality", DEFAULT_QUALITY)
     
     # Create two columns for uploads
     col1, col2 = st.columns([1, 1], gap="large")
@@ -90,14 +363,22 @@ def main():
             help="Upload a clear, front-facing photo for best results"
         )
         
+        human_upload = None
+        human_image = None
         if human_file is not None:
-            human_image = Image.open(human_file)
+            human_upload = get_upload_images(human_file, 'human', selected_quality)
+            human_image = human_upload["image"]
+            if human_image is None:
+                st.error(f"❌ {human_upload['message']}")
+        
+        if human_image is not None:
             st.markdown('<div class="image-container">', unsafe_allow_html=True)
-            st.image(human_image, caption="Your Photo", use_container_width=True)
+            st.image(human_upload["display"], caption="Your Photo", use_container_width=True)
             st.markdown('</div>', unsafe_allow_html=True)
             
             # Image info
-            st.info(f"📊 Image size: {human_image.size[0]}x{human_image.size[1]} pixels")
+            original_size = human_image.info.get('original_size', human_image.size)
+            st.info(f"📊 Image size: {original_size[0]}x{original_size[1]} pixels")
     
     with col2:
         st.markdown("""
@@ -113,14 +394,22 @@ def main():
             help="Upload an image of the dress you want to try on"
         )
         
+        dress_upload = None
+        dress_image = None
         if dress_file is not None:
-            dress_image = Image.open(dress_file)
+            dress_upload = get_upload_images(dress_file, 'dress', selected_quality)
+            dress_image = dress_upload["image"]
+            if dress_image is None:
+                st.error(f"❌ {dress_upload['message']}")
+        
+        if dress_image is not None:
             st.markdown('<div class="image-container">', unsafe_allow_html=True)
-            st.image(dress_image, caption="Dress", use_container_width=True)
+            st.image(dress_upload["display"], caption="Dress", use_container_width=True)
             st.markdown('</div>', unsafe_allow_html=True)
             
             # Image info
-            st.info(f"📊 Image size: {dress_image.size[0]}x{dress_image.size[1]} pixels")
+            original_size = dress_image.info.get('original_size', dress_image.size)
+            st.info(f"📊 Image size: {original_size[0]}x{original_size[1]} pixels")
     
     # Advanced options
     with st.expander("🔧 Advanced Options", expanded=False):
@@ -128,9 +417,10 @@ def main():
         with col_opt1:
             quality = st.select_slider(
                 "Output Quality",
-                options=["Fast", "Balanced", "High Quality"],
-                value="Balanced",
-                help="Higher quality takes more time to process"
+                options=list(QUALITY_PROFILES),
+                value=DEFAULT_QUALITY,
+                key="output_quality",
+                help="Fast gives an instant local preview without AI analysis; higher quality takes more time to process"
             )
         with col_opt2:
             enable_analysis = st.checkbox(
@@ -138,11 +428,32 @@ def main():
                 value=True,
                 help="Get AI-powered style compatibility analysis"
             )
+            combined_analysis = st.checkbox(
+                "Combined AI Analysis",
+                value=True,
+                help="Get fitting, style analysis and styling tips from a single AI request"
+            )
+    
+    analysis_mode = 'fused' if combined_analysis else 'standard'
+    # Fast previews skip the model, so there is no analysis to show
+    enable_analysis = enable_analysis and QUALITY_PROFILES[quality]['use_model']
     
     # Process button with enhanced styling
     st.markdown("<br>", unsafe_allow_html=True)
+    pair = None
+    if human_image is not None and dress_image is not None:
+        pair = (human_upload["digest"], dress_upload["digest"])
+    
+    def load_inputs():
+        # Preprocessed images are memoized per upload, so this is cheap after the first call
+        return (
+            get_processed_image(human_upload),
+            get_processed_image(dress_upload),
+            create_synthesizer(api_key, selected_quality, analysis_mode)
+        )
+    
     if st.button("✨ Generate Virtual Try-On", type="primary", use_container_width=True):
-        if human_file is not None and dress_file is not None:
+        if pair is not None:
             # Progress tracking
             progress_bar = st.progress(0)
             status_text = st.empty()
@@ -152,82 +463,46 @@ def main():
                 status_text.text("🔄 Processing images...")
                 progress_bar.progress(20)
                 
-                processed_human = image_processor.preprocess_human_image(human_image)
-                processed_dress = image_processor.preprocess_dress_image(dress_image)
+                processed_human, processed_dress, dress_synthesizer = load_inputs()
                 
                 # Step 2: Generate try-on
                 status_text.text("🎨 Generating virtual try-on...")
-                progress_bar.progress(60)
+                progress_bar.progress(40)
                 
-                result_image = dress_synthesizer.generate_try_on(
-                    processed_human, 
-                    processed_dress
-                )
+                # Live analysis text and the preview render here while the try-on streams
+                image_placeholder = st.empty()
+                live_placeholder = st.empty()
+                result_image, error = asyncio.run(stream_try_on_into(
+                    dress_synthesizer.generate_try_on_stream_async(processed_human, processed_dress),
+                    image_placeholder, live_placeholder, progress_bar, status_text
+                ))
                 
                 progress_bar.progress(100)
                 status_text.text("✅ Complete!")
                 
-                # Success message
-                st.markdown(get_success_message_html(), unsafe_allow_html=True)
-                
-                # Display result in styled container
-                st.markdown("""
-                <div class="result-section">
-                    <h2 style="color: #2C3E50; text-align: center; margin-bottom: 1rem;">
-                        🎉 Your Virtual Try-On Result
-                    </h2>
-                </div>
-                """, unsafe_allow_html=True)
-                
-                # Create tabs for different views
-                tab1, tab2, tab3 = st.tabs(["🖼️ Result", "📊 Analysis", "💡 Styling Tips"])
-                
-                with tab1:
-                    st.image(result_image, caption="Virtual Try-On Result", use_container_width=True)
-                    
-                    # Save result
-                    timestamp = int(time.time())
-                    output_path = f"outputs/try_on_result_{timestamp}.png"
-                    os.makedirs("outputs", exist_ok=True)
+                # Save result
+                timestamp = int(time.time())
+                output_path = f"outputs/try_on_result_{timestamp}.png"
+                os.makedirs("outputs", exist_ok=True)
+                with METRICS.span('stage_seconds', stage='save'):
                     result_image.save(output_path)
-                    
-                    # Download section
-                    col_download1, col_download2 = st.columns([2, 1])
-                    with col_download1:
-                        img_buffer = io.BytesIO()
-                        result_image.save(img_buffer, format='PNG')
-                        img_buffer.seek(0)
-                        
-                        st.download_button(
-                            label="💾 Download High Quality",
-                            data=img_buffer.getvalue(),
-                            file_name=f"virtual_try_on_{timestamp}.png",
-                            mime="image/png",
-                            use_container_width=True
-                        )
-                    
-                    with col_download2:
-                        st.info(f"💾 Saved to: {output_path}")
-                
-                with tab2:
-                    if enable_analysis:
-                        with st.spinner("Analyzing style compatibility..."):
-                            analysis = dress_synthesizer.analyze_compatibility(processed_human, processed_dress)
-                            st.markdown("### 🔍 Style Analysis")
-                            st.write(analysis)
-                    else:
-                        st.info("Style analysis is disabled. Enable it in Advanced Options.")
+                img_buffer = io.BytesIO()
+                result_image.save(img_buffer, format='PNG')
                 
-                with tab3:
-                    if enable_analysis:
-                        with st.spinner("Generating styling suggestions..."):
-                            suggestions = dress_synthesizer.get_styling_suggestions(processed_human, processed_dress)
-                            st.markdown("### 💄 Styling Suggestions")
-                            st.write(suggestions)
-                    else:
-                        st.info("Styling suggestions require style analysis to be enabled.")
+                # Keep the result in the session so later reruns (downloads,
+                # opening the analysis tabs) show it without generating again
+                st.session_state["try_on_result"] = {
+                    "pair": pair,
+                    "image": result_image,
+                    "png": img_buffer.getvalue(),
+                    "error": error,
+                    "timestamp": timestamp,
+                    "output_path": output_path,
+                }
                 
                 # Clear progress indicators
+                image_placeholder.empty()
+                live_placeholder.empty()
                 progress_bar.empty()
                 status_text.empty()
                 
@@ -239,6 +514,11 @@ def main():
         else:
             st.warning("⚠️ Please upload both a human photo and a dress image to continue.")
     
+    # The latest result stays on screen until either upload changes
+    result = st.session_state.get("try_on_result")
+    if result is not None and result["pair"] == pair:
+        render_try_on_result(result, enable_analysis, load_inputs)
+    
     # Enhanced sidebar with better organization
     with st.sidebar:
         st.markdown("### 📋 How to Use")
@@ -254,13 +534,9 @@ def main():
         
         st.markdown("---")
         
-        # Statistics (mock data for demo)
+        # Live statistics for this server process
         st.markdown("### 📊 App Statistics")
-        col_stat1, col_stat2 = st.columns(2)
-        with col_stat1:
-            st.metric("Try-ons Generated", "1,234", "+89")
-        with col_stat2:
-            st.metric("Happy Users", "567", "+23")
+        render_metrics(METRICS)
         
         st.markdown("---")
         
@@ -288,6 +564,9 @@ def main():
                 st.success("Thank you for your feedback!")
             else:
                 st.warning("Please enter your feedback first.")
+    
+    # Everything is on screen; load the heavy modules before the first Generate click
+    warm_up_imports()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
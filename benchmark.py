@@ -0,0 +1,255 @@
+"""
+Offline benchmark suite for the virtual try-on pipeline.
+
+Times every pipeline stage across a matrix of input resolutions and output
+quality modes, and runs generate_try_on end to end against a deterministic
+fake model, so no API key or network access is needed:
+
+    python benchmark.py
+    python benchmark.py --save benchmarks/baseline.json
+    python benchmark.py --compare benchmarks/baseline.json
+
+Each case reports the median wall time over --repeat runs and the peak
+memory of one extra run. Peak memory is measured with tracemalloc, which
+sees Python and NumPy allocations but not Pillow's internal image buffers.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+from PIL import Image
+import numpy as np
+
+from src.compositor import enhance_region
+from src.image_utils import ImageProcessor
+from src.dress_synthesizer import DressSynthesizer
+from src.fake_model import FakeModel
+from src.landmarks import estimate_landmarks
+from src.quality import QUALITY_PROFILES
+
+# Upload sizes (width, height): a small phone crop, a 2MP and a 12MP photo
+DEFAULT_RESOLUTIONS = [(640, 960), (1200, 1600), (3024, 4032)]
+DEFAULT_QUALITIES = list(QUALITY_PROFILES)
+ANALYSIS_MODES = ['standard', 'fused', 'split']
+FITTING_INFO = {'body_type': 'average', 'dress_style': 'regular', 'dress_position': 'chest'}
+EFFECTS_DESCRIPTION = "A vibrant dress with soft, flowing fabric"
+
+
+def make_pattern_image(size, seed=0):
+    """Return a deterministic photo-like RGB image: smooth gradients plus noise"""
+    width, height = size
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    pixels = np.empty((height, width, 3), dtype=np.float32)
+    pixels[..., 0] = 128 + 100 * np.sin(x / width * 3.1)
+    pixels[..., 1] = 128 + 100 * np.cos(y / height * 4.7)
+    pixels[..., 2] = 128 + 60 * np.sin((x + y) / (width + height) * 9.0)
+    pixels += rng.normal(0, 12, pixels.shape)
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+
+def make_person_image(size, seed=0):
+    """
+    Return a deterministic person-like RGB image: a patterned figure on a
+    plain, noisy backdrop, so landmark estimation finds a silhouette
+    """
+    width, height = size
+    rng = np.random.default_rng(seed + 100)
+    pixels = np.asarray(make_pattern_image(size, seed)).copy()
+    y, x = np.mgrid[0:height, 0:width]
+    offset = np.abs(x - width / 2) / width
+    row = y / height
+    head = (offset / 0.07) ** 2 + ((row - 0.12) / 0.06) ** 2 <= 1
+    # Half-widths of the figure down the frame: neck, shoulders, waist, hips, legs
+    half_width = np.interp(row, [0.18, 0.22, 0.45, 0.55, 0.95], [0.06, 0.2, 0.13, 0.18, 0.12])
+    body = (offset <= half_width) & (row >= 0.18) & (row <= 0.95)
+    backdrop = ~(head | body)
+    pixels[backdrop] = np.clip(rng.normal(225, 6, (int(backdrop.sum()), 3)), 0, 255).astype(np.uint8)
+    return Image.fromarray(pixels)
+
+
+def make_dress_image(size, seed=1):
+    """Return a deterministic dress-like RGB image: a patterned shape on white"""
+    width, height = size
+    image = make_pattern_image(size, seed)
+    pixels = np.asarray(image).copy()
+    y, x = np.mgrid[0:height, 0:width]
+    outside = np.abs(x - width / 2) > (0.15 + 0.3 * y / height) * width
+    pixels[outside] = 255
+    return Image.fromarray(pixels)
+
+
+def encode_jpeg(image, quality=90):
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def measure(fn, setup=None, repeat=5):
+    """
+    Time fn(*setup()) repeat times and once more under tracemalloc.
+    setup runs outside the timed region. Returns (median seconds, peak bytes).
+    """
+    times = []
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - start)
+
+    args = setup() if setup else ()
+    tracemalloc.start()
+    try:
+        fn(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return statistics.median(times), peak
+
+
+def stage_cases(resolution, quality):
+    """Yield (stage, fn, setup) for each pipeline stage at one resolution and quality"""
+    processor = ImageProcessor(quality=quality)
+    synthesizer = DressSynthesizer(None, quality=quality)
+    person = make_person_image(resolution)
+    dress = make_dress_image(resolution)
+    person_jpeg = encode_jpeg(person)
+
+    processed_person = processor.preprocess_human_image(person)
+    processed_dress = processor.preprocess_dress_image(dress)
+    # Fit and place from landmarks, with the layer sizes the real pipeline uses
+    body = estimate_landmarks(processed_person)
+    dress_layer = synthesizer._create_fitted_dress_layer(processed_dress, processed_person, FITTING_INFO, body)
+    composite = synthesizer._composite_dress_on_body(processed_person, dress_layer, FITTING_INFO, body)
+    position = synthesizer._dress_position(processed_person.size, dress_layer.size, FITTING_INFO, body)
+    effects_chain = synthesizer._effects_chain(EFFECTS_DESCRIPTION)
+
+    yield 'load_image', lambda data: processor.load_image(io.BytesIO(data)), lambda: (person_jpeg,)
+    yield 'preprocess_human', processor.preprocess_human_image, lambda: (person,)
+    yield 'preprocess_dress', processor.preprocess_dress_image, lambda: (dress,)
+    yield 'prepare_for_model', synthesizer._prepare_image_for_gemini, lambda: (processed_person,)
+    # The uncached estimator: LandmarkEstimator would serve repeats from its cache
+    yield 'landmarks', estimate_landmarks, lambda: (processed_person,)
+    yield 'fit_dress', synthesizer._create_fitted_dress_layer, \
+        lambda: (processed_dress, processed_person, FITTING_INFO, body)
+    yield 'composite', synthesizer._composite_dress_on_body, \
+        lambda: (processed_person, dress_layer, FITTING_INFO, body)
+    # Effects rewrite the dress region of the composite buffer in place, so each run gets a fresh buffer
+    yield 'effects', lambda target: enhance_region(target, dress_layer.size, position, effects_chain), \
+        lambda: (np.array(composite),)
+
+
+def end_to_end_cases(resolution, quality, latency):
+    """Yield (case, fn, setup) running generate_try_on against the fake model"""
+    processor = ImageProcessor(quality=quality)
+    person = processor.preprocess_human_image(make_person_image(resolution))
+    dress = processor.preprocess_dress_image(make_dress_image(resolution))
+
+    for mode in ANALYSIS_MODES:
+        def setup(mode=mode):
+            # A fresh synthesizer per run, so fused results are not reused between runs
+            synthesizer = DressSynthesizer(FakeModel(latency=latency), analysis_mode=mode, quality=quality)
+            return synthesizer, person, dress
+
+        yield f'generate_try_on[{mode}]', \
+            lambda synthesizer, h, d: synthesizer.generate_try_on(h, d), setup
+
+
+def run_benchmarks(resolutions=None, qualities=None, latency=0.05, repeat=5, log=print):
+    """Run the whole matrix; returns {case name: {'seconds': ..., 'peak_mb': ...}}"""
+    resolutions = resolutions or DEFAULT_RESOLUTIONS
+    qualities = qualities or DEFAULT_QUALITIES
+    results = {}
+
+    for quality in qualities:
+        for resolution in resolutions:
+            label = f"{quality}/{resolution[0]}x{resolution[1]}"
+            cases = list(stage_cases(resolution, quality))
+            cases += list(end_to_end_cases(resolution, quality, latency))
+            for stage, fn, setup in cases:
+                seconds, peak = measure(fn, setup, repeat)
+                name = f"{label}/{stage}"
+                results[name] = {'seconds': seconds, 'peak_mb': peak / (1024 * 1024)}
+                if log:
+                    log(f"{name:<55} {seconds * 1000:9.2f} ms {peak / (1024 * 1024):9.2f} MB")
+
+    return results
+
+
+def compare(results, baseline, threshold=1.2):
+    """Return a line per case whose time or peak memory regressed past threshold"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        for metric in ('seconds', 'peak_mb'):
+            # Ignore noise on stages too small to measure reliably
+            floor = 0.001 if metric == 'seconds' else 0.5
+            if previous[metric] < floor and current[metric] < floor:
+                continue
+            ratio = current[metric] / max(previous[metric], 1e-9)
+            if ratio > threshold:
+                regressions.append(
+                    f"{name} {metric}: {previous[metric]:.4f} -> {current[metric]:.4f} ({ratio:.2f}x)"
+                )
+    return regressions
+
+
+def parse_resolution(value):
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the try-on pipeline")
+    parser.add_argument('--resolution', action='append', type=parse_resolution,
+                        help="Input resolution as WxH; repeat for several (default: 640x960, 1200x1600, 3024x4032)")
+    parser.add_argument('--quality', action='append', choices=DEFAULT_QUALITIES,
+                        help="Output quality mode; repeat for several (default: all)")
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help="Seconds each fake model call takes (default: 0.05)")
+    parser.add_argument('--repeat', type=int, default=5, help="Timed runs per case (default: 5)")
+    parser.add_argument('--save', metavar='PATH', help="Write the results to a JSON baseline")
+    parser.add_argument('--compare', metavar='PATH', help="Compare against a saved JSON baseline")
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help="Slowdown ratio reported as a regression (default: 1.2)")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.resolution, args.quality, args.latency, args.repeat)
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.save) or '.', exist_ok=True)
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'latency': args.latency,
+                'results': results,
+            }, f, indent=2)
+        print(f"Baseline saved to {args.save}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline['results'], args.threshold)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s) against {args.compare}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"\n✅ No regressions against {args.compare}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,248 @@
+"""
+Headless batch try-on renderer.
+
+Renders every person/dress pair from a manifest, or every combination of
+two directories, with parallel workers and no browser in the loop:
+
+    python -m src.batch --people people/ --dresses dresses/ --output renders/
+    python -m src.batch --manifest pairs.csv --output renders/ --workers 8
+
+A manifest is a CSV with person,dress[,id] columns or a JSONL file with the
+same keys; relative paths are resolved against the manifest's directory.
+Each result is written to OUTPUT/<id>.png and recorded in OUTPUT/index.jsonl.
+Re-running the same command skips pairs already rendered, so an interrupted
+run resumes where it stopped.
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+from .cache import ResultCache
+from .dress_synthesizer import DressSynthesizer
+from .image_utils import ImageProcessor
+from .quality import DEFAULT_QUALITY, QUALITY_PROFILES
+from .resilience import ResiliencePolicy
+
+INDEX_FILE = 'index.jsonl'
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+DEFAULT_MODEL = 'gemini-1.5-flash'
+
+
+def _list_images(directory):
+    return [
+        os.path.join(directory, name) for name in sorted(os.listdir(directory))
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    ]
+
+
+def _stem(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def pairs_from_directories(people_dir, dresses_dir):
+    """Return one pair for every person/dress combination"""
+    return [
+        {'id': f"{_stem(person)}__{_stem(dress)}", 'person': person, 'dress': dress}
+        for person in _list_images(people_dir)
+        for dress in _list_images(dresses_dir)
+    ]
+
+
+def pairs_from_manifest(path):
+    """Read pairs from a CSV (person,dress[,id]) or JSONL manifest"""
+    base_dir = os.path.dirname(os.path.abspath(path))
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if path.lower().endswith(('.jsonl', '.json')):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = list(csv.DictReader(f))
+
+    pairs = []
+    for row in rows:
+        person = os.path.join(base_dir, row['person'])
+        dress = os.path.join(base_dir, row['dress'])
+        pair_id = row.get('id') or f"{_stem(person)}__{_stem(dress)}"
+        pairs.append({'id': pair_id, 'person': person, 'dress': dress})
+    return pairs
+
+
+def load_index(output_dir):
+    """Return the latest index record per pair id from a previous run"""
+    records = {}
+    path = os.path.join(output_dir, INDEX_FILE)
+    if not os.path.exists(path):
+        return records
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # A line cut short by an interrupted run
+            records[record['id']] = record
+    return records
+
+
+def is_done(record, output_dir, retry_fallbacks=False):
+    """True if a pair was rendered by an earlier run and need not be redone"""
+    if record is None or record.get('status') != 'ok':
+        return False
+    if retry_fallbacks and record.get('error'):
+        return False
+    return os.path.exists(os.path.join(output_dir, record['output']))
+
+
+class BatchRenderer:
+    """Renders pairs with a shared synthesizer; safe to call from worker threads"""
+
+    def __init__(self, synthesizer, image_processor, output_dir):
+        self.synthesizer = synthesizer
+        self.image_processor = image_processor
+        self.output_dir = output_dir
+        self._index_lock = threading.Lock()
+        # People are usually shared by many pairs, so keep their preprocessed images
+        self._load_person = functools.lru_cache(maxsize=32)(self._load_person_uncached)
+
+    def _load(self, path, purpose):
+        with open(path, 'rb') as f:
+            image, message = self.image_processor.load_image(f, purpose=purpose)
+        if image is None:
+            raise ValueError(f"{path}: {message}")
+        return image
+
+    def _load_person_uncached(self, path):
+        return self.image_processor.preprocess_human_image(self._load(path, 'human'))
+
+    def render(self, pair):
+        """Render one pair and append its record to the index; returns the record"""
+        started = time.perf_counter()
+        record = {'id': pair['id'], 'person': pair['person'], 'dress': pair['dress']}
+        try:
+            human_image = self._load_person(pair['person'])
+            dress_image = self.image_processor.preprocess_dress_image(self._load(pair['dress'], 'dress'))
+            result_image, error = self.synthesizer.generate_try_on_checked(human_image, dress_image)
+
+            output = f"{pair['id']}.png"
+            # Write to a temporary file first so a crash never leaves a half-written result
+            temp_path = os.path.join(self.output_dir, output + '.tmp')
+            result_image.save(temp_path, format='PNG')
+            os.replace(temp_path, os.path.join(self.output_dir, output))
+
+            record.update({'status': 'ok', 'output': output, 'error': error})
+        except Exception as e:
+            record.update({'status': 'failed', 'output': None, 'error': str(e)})
+
+        record['seconds'] = round(time.perf_counter() - started, 3)
+        self._append_index(record)
+        return record
+
+    def _append_index(self, record):
+        with self._index_lock:
+            with open(os.path.join(self.output_dir, INDEX_FILE), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record) + '\n')
+                f.flush()
+
+
+def run_batch(pairs, output_dir, synthesizer, image_processor, workers=4,
+              retry_fallbacks=False, log=print):
+    """Render every pair not already done; returns (rendered, skipped, failed) counts"""
+    os.makedirs(output_dir, exist_ok=True)
+    previous = load_index(output_dir)
+    todo = [
+        pair for pair in pairs
+        if not is_done(previous.get(pair['id']), output_dir, retry_fallbacks)
+    ]
+    skipped = len(pairs) - len(todo)
+    if log and skipped:
+        log(f"Skipping {skipped} pair(s) already rendered")
+
+    renderer = BatchRenderer(synthesizer, image_processor, output_dir)
+    rendered = failed = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(renderer.render, pair) for pair in todo]
+        for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            record = future.result()
+            if record['status'] == 'ok':
+                rendered += 1
+            else:
+                failed += 1
+            if log:
+                note = f" ({record['error']})" if record['error'] else ''
+                log(f"[{done}/{len(todo)}] {record['id']}: {record['status']} "
+                    f"in {record['seconds']:.2f}s{note}")
+
+    return rendered, skipped, failed
+
+
+def create_model(args):
+    """Return the model the batch runs against: the offline stub or Gemini"""
+    if args.stub:
+        from .fake_model import FakeModel
+
+        return FakeModel(latency=args.stub_latency)
+
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        raise SystemExit("GEMINI_API_KEY is not set (use --stub to run without the API)")
+
+    import google.generativeai as genai
+
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(args.model)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render virtual try-ons without the web UI")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--manifest', help="CSV (person,dress[,id]) or JSONL file of pairs")
+    source.add_argument('--people', help="Directory of person photos; combined with --dresses")
+    parser.add_argument('--dresses', help="Directory of dress images; required with --people")
+    parser.add_argument('--output', required=True, help="Directory for results and index.jsonl")
+    parser.add_argument('--workers', type=int, default=4, help="Pairs rendered in parallel (default: 4)")
+    parser.add_argument('--quality', choices=list(QUALITY_PROFILES), default=DEFAULT_QUALITY)
+    parser.add_argument('--analysis-mode', choices=['standard', 'fused', 'split'], default='fused',
+                        help="'fused' makes one model call per pair (default); 'split' makes one "
+                             "per unique person and one per unique dress")
+    parser.add_argument('--model', default=DEFAULT_MODEL, help=f"Gemini model (default: {DEFAULT_MODEL})")
+    parser.add_argument('--cache-dir', default=os.path.join('.cache', 'gemini'),
+                        help="Analysis result cache shared with the app")
+    parser.add_argument('--retry-fallbacks', action='store_true',
+                        help="Re-render pairs that previously fell back to the local composite")
+    parser.add_argument('--stub', action='store_true', help="Use the offline fake model instead of Gemini")
+    parser.add_argument('--stub-latency', type=float, default=0.0,
+                        help="Seconds each fake model call takes (default: 0)")
+    args = parser.parse_args(argv)
+
+    if args.people and not args.dresses:
+        parser.error("--dresses is required with --people")
+
+    pairs = pairs_from_manifest(args.manifest) if args.manifest else \
+        pairs_from_directories(args.people, args.dresses)
+
+    synthesizer = DressSynthesizer(
+        create_model(args),
+        cache=ResultCache(cache_dir=args.cache_dir),
+        analysis_mode=args.analysis_mode,
+        max_concurrency=args.workers,
+        quality=args.quality,
+        # Room for every worker's model call plus its hedge
+        resilience=ResiliencePolicy(max_workers=2 * args.workers)
+    )
+    image_processor = ImageProcessor(quality=args.quality)
+
+    rendered, skipped, failed = run_batch(
+        pairs, args.output, synthesizer, image_processor, args.workers, args.retry_fallbacks
+    )
+    print(f"Done: {rendered} rendered, {skipped} skipped, {failed} failed "
+          f"(index: {os.path.join(args.output, INDEX_FILE)})")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+# id(image) -> (weak reference, mode, size, digest). Keyed by identity rather
+# than stored in image.info, because Pillow copies info into derived images.
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+def image_digest(image):
+    """
+    Return a content hash of a PIL image's decoded pixels. The hash is
+    remembered for as long as the image object lives, so images must not be
+    modified in place once they have been hashed.
+    """
+    key = id(image)
+    with _digests_lock:
+        entry = _digests.get(key)
+    if entry is not None and entry[0]() is image and entry[1:3] == (image.mode, image.size):
+        return entry[3]
+
+    hasher = hashlib.sha256()
+    hasher.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+    hasher.update(image.tobytes())
+    digest = hasher.hexdigest()
+
+    def forget(_, key=key):
+        with _digests_lock:
+            _digests.pop(key, None)
+
+    with _digests_lock:
+        _digests[key] = (weakref.ref(image, forget), image.mode, image.size, digest)
+    return digest
+
+
+def make_cache_key(model_name, prompt, image_digests):
+    """Build a cache key from the model name, prompt text and image hashes"""
+    hasher = hashlib.sha256()
+    hasher.update(str(model_name).encode())
+    hasher.update(b"\0")
+    hasher.update(prompt.encode())
+    for digest in image_digests:
+        hasher.update(b"\0")
+        hasher.update(digest.encode())
+    return hasher.hexdigest()
+
+
+class ResultCache:
+    """Two-tier (memory LRU + on-disk) cache for model response text"""
+
+    def __init__(self, max_entries=256, cache_dir=None, max_disk_bytes=50 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get(self, key):
+        """Return the cached value for key, or None if it is not cached"""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+
+        value = self._read_disk(key)
+
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, value)
+        return value
+
+    def set(self, key, value):
+        """Store value under key in both tiers"""
+        with self._lock:
+            self._remember(key, value)
+        self._write_disk(key, value)
+
+    def clear(self):
+        """Drop every entry from both tiers"""
+        with self._lock:
+            self._memory.clear()
+        if self.cache_dir:
+            for name in os.listdir(self.cache_dir):
+                if name.endswith('.json'):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+    def _remember(self, key, value):
+        # Caller must hold self._lock
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _path_for(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _read_disk(self, key):
+        if not self.cache_dir:
+            return None
+
+        path = self._path_for(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                value = json.load(f)['value']
+            # Touch the file so disk eviction is least-recently-used
+            os.utime(path, None)
+            return value
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write_disk(self, key, value):
+        if not self.cache_dir:
+            return
+
+        path = self._path_for(key)
+        # The directory may be shared by several processes
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'value': value}, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            # The disk tier is best-effort; the memory tier still has the value
+            return
+
+        self._evict_disk()
+
+    def _evict_disk(self):
+        """Remove least-recently-used files until the directory fits the size cap"""
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        if total <= self.max_disk_bytes:
+            return
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
@@ -0,0 +1,161 @@
+"""
+Precompiled dress catalog asset store.
+
+An offline build step preprocesses every dress once and writes it, with a
+small pyramid of pre-resampled widths, as .npy files that the runtime
+memory-maps on demand:
+
+    python -m src.catalog build path/to/dresses path/to/catalog
+
+A fitted layer is resampled from the smallest level that is still at least
+as large, so any layer size the pipeline asks for, landmark-fitted ones
+included, is served from the catalog. Layers are RGB, like the dresses
+preprocess_dress_image returns.
+"""
+
+import argparse
+import json
+import os
+import threading
+
+from PIL import Image
+import numpy as np
+
+from .image_utils import ImageProcessor
+from .quality import DEFAULT_QUALITY, QUALITY_PROFILES
+
+INDEX_FILE = 'index.json'
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+# Widths of the pyramid levels, as fractions of the preprocessed dress
+PYRAMID_SCALES = (1.0, 0.75, 0.5, 0.375, 0.25)
+
+
+def pyramid_sizes(size, scales=PYRAMID_SCALES):
+    """Return the distinct level sizes for a dress of size, largest first"""
+    width, height = size
+    sizes = []
+    for scale in scales:
+        level = (max(1, round(width * scale)), max(1, round(height * scale)))
+        if level not in sizes:
+            sizes.append(level)
+    return sorted(sizes, reverse=True)
+
+
+def _level_file(size):
+    return f'level_{size[0]}x{size[1]}.npy'
+
+
+def build_catalog(source_dir, output_dir, image_processor=None, scales=PYRAMID_SCALES, log=print):
+    """
+    Preprocess every dress image in source_dir into output_dir.
+    Returns the catalog index that was written.
+    """
+    image_processor = image_processor or ImageProcessor()
+    os.makedirs(output_dir, exist_ok=True)
+
+    index = {}
+    for name in sorted(os.listdir(source_dir)):
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+
+        dress_id = os.path.splitext(name)[0]
+        with open(os.path.join(source_dir, name), 'rb') as f:
+            image, message = image_processor.load_image(f, purpose='dress')
+        if image is None:
+            if log:
+                log(f"Skipping {name}: {message}")
+            continue
+
+        processed = image_processor.preprocess_dress_image(image)
+        levels = pyramid_sizes(processed.size, scales)
+
+        dress_dir = os.path.join(output_dir, dress_id)
+        os.makedirs(dress_dir, exist_ok=True)
+        for size in levels:
+            level = processed if size == processed.size else processed.resize(size, Image.Resampling.LANCZOS)
+            np.save(os.path.join(dress_dir, _level_file(size)), np.asarray(level))
+
+        index[dress_id] = {
+            'source': name,
+            'quality': image_processor.quality,
+            'size': list(processed.size),
+            'levels': [list(size) for size in levels],
+        }
+        if log:
+            log(f"Compiled {name}")
+
+    with open(os.path.join(output_dir, INDEX_FILE), 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=2)
+
+    return index
+
+
+class DressCatalog:
+    """Read-only view of a compiled catalog; assets are memory-mapped lazily"""
+
+    def __init__(self, root):
+        self.root = root
+        with open(os.path.join(root, INDEX_FILE), 'r', encoding='utf-8') as f:
+            self.index = json.load(f)
+        self._arrays = {}
+        self._lock = threading.Lock()
+
+    def dress_ids(self):
+        return list(self.index)
+
+    def get(self, dress_id):
+        """Return the preprocessed dress as an RGB image tagged with its catalog id"""
+        pixels = self._load(dress_id, _level_file(self.index[dress_id]['size']))
+        image = Image.fromarray(np.ascontiguousarray(pixels))
+        image.info['catalog_id'] = dress_id
+        return image
+
+    def get_fitted(self, dress_id, size, resample=Image.Resampling.LANCZOS, quality=None):
+        """
+        Return the dress resized to size, resampled from the smallest pyramid
+        level that covers it (the full-size dress when none is smaller), or
+        None if dress_id is not in the catalog or, when quality is given, was
+        compiled for another quality profile.
+        """
+        entry = self.index.get(dress_id)
+        if entry is None or (quality is not None and entry.get('quality') != quality):
+            return None
+        size = tuple(size)
+        level = entry['size']
+        for candidate in entry['levels']:
+            if candidate[0] >= size[0] and candidate[1] >= size[1] and candidate[0] < level[0]:
+                level = candidate
+        image = Image.fromarray(np.ascontiguousarray(self._load(dress_id, _level_file(level))))
+        if tuple(level) == size:
+            return image
+        return image.resize(size, resample)
+
+    def _load(self, dress_id, file_name):
+        key = (dress_id, file_name)
+        with self._lock:
+            pixels = self._arrays.get(key)
+            if pixels is None:
+                path = os.path.join(self.root, dress_id, file_name)
+                pixels = np.load(path, mmap_mode='r')
+                self._arrays[key] = pixels
+            return pixels
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dress catalog asset store")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help="Compile a directory of dress images")
+    build_parser.add_argument('source_dir', help="Directory containing dress images")
+    build_parser.add_argument('output_dir', help="Directory to write the compiled catalog to")
+    build_parser.add_argument('--quality', choices=list(QUALITY_PROFILES), default=DEFAULT_QUALITY,
+                              help="Quality profile the dresses are preprocessed for")
+
+    args = parser.parse_args(argv)
+    if args.command == 'build':
+        index = build_catalog(args.source_dir, args.output_dir, ImageProcessor(quality=args.quality))
+        print(f"Catalog with {len(index)} dresses written to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
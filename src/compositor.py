@@ -0,0 +1,205 @@
+from PIL import Image
+import numpy as np
+
+from .enhance import BAND_ROWS
+
+
+def build_alpha_lut(transform):
+    """
+    Precompute a 256-entry uint8 lookup table for an alpha transform,
+    rounding the same way Image.point does for Python callables
+    """
+    return np.array(
+        [min(255, max(0, round(transform(value)))) for value in range(256)],
+        dtype=np.uint8
+    )
+
+
+# Alpha transforms used by the try-on paths, computed once at import time
+SIMPLE_OVERLAY_LUT = build_alpha_lut(lambda p: p * 0.7)
+DRESS_OVERLAY_LUT = build_alpha_lut(lambda p: p * 0.8)
+BODY_COMPOSITE_LUT = build_alpha_lut(lambda p: int(p * 0.85) if p > 128 else int(p * 0.7))
+
+# Pasting a layer through its own alpha mask multiplies the alpha by itself
+_PASTE_COVERAGE_LUT = np.array(
+    [(a * a + 127) // 255 for a in range(256)], dtype=np.uint16
+)
+
+
+def _div255_inplace(values):
+    """Exact floor division by 255, in place, for uint16 arrays up to 255 * 255 + 127"""
+    values += 1 + (values >> 8)
+    values >>= 8
+    return values
+
+
+def _layer_arrays(layer, alpha_lut):
+    """Return (rgb, scaled_alpha) for a PIL layer; alpha is a scalar for opaque layers"""
+    if layer.mode == 'RGBA':
+        pixels = np.asarray(layer)
+        return pixels[..., :3], alpha_lut[pixels[..., 3]]
+
+    if layer.mode != 'RGB':
+        layer = layer.convert('RGB')
+    # Layers without alpha are fully opaque, so the LUT collapses to a scalar
+    return np.asarray(layer), int(alpha_lut[255])
+
+
+def _clip_region(base_size, layer_size, position):
+    """Intersect a layer placed at position with the base; returns slices or None"""
+    x, y = position
+    left, top = max(x, 0), max(y, 0)
+    right = min(x + layer_size[0], base_size[0])
+    bottom = min(y + layer_size[1], base_size[1])
+    if right <= left or bottom <= top:
+        return None
+    base_region = (slice(top, bottom), slice(left, right))
+    layer_region = (slice(top - y, bottom - y), slice(left - x, right - x))
+    return base_region, layer_region
+
+
+def blend_into(target, layer, position, alpha_lut, band_rows=BAND_ROWS):
+    """
+    Blend a PIL layer into a uint8 RGB array in place, in one pass over the
+    layer's footprint. Matches pasting the layer (with its alpha scaled by
+    alpha_lut) onto a transparent overlay and alpha-compositing that overlay.
+    The footprint is processed band_rows rows at a time to bound the
+    temporary arrays; every pixel is independent, so banding is exact.
+    """
+    regions = _clip_region((target.shape[1], target.shape[0]), layer.size, position)
+    if regions is None:
+        return target
+    (base_rows, base_cols), (layer_rows, layer_cols) = regions
+    height = base_rows.stop - base_rows.start
+    band_rows = band_rows or height
+
+    for offset in range(0, height, band_rows):
+        rows = min(band_rows, height - offset)
+        box = (layer_cols.start, layer_rows.start + offset, layer_cols.stop, layer_rows.start + offset + rows)
+        # Only this band of the layer is converted to arrays
+        band = layer if box == (0, 0) + layer.size else layer.crop(box)
+        top = base_rows.start + offset
+        _blend_band(target[top:top + rows, base_cols], band, alpha_lut)
+    return target
+
+
+def _blend_band(base, layer, alpha_lut):
+    """Blend a PIL layer exactly covering the uint8 array base into it in place"""
+    rgb, alpha = _layer_arrays(layer, alpha_lut)
+
+    if np.isscalar(alpha):
+        # Opaque layers blend with constant weights
+        coverage = int(_PASTE_COVERAGE_LUT[alpha])
+    else:
+        alpha = alpha.astype(np.uint16)[..., None]
+        coverage = _PASTE_COVERAGE_LUT[alpha]
+
+    # Colour left on the overlay after the masked paste, premultiplied by alpha
+    blended = rgb.astype(np.uint16)
+    blended *= alpha
+    blended += 127
+    _div255_inplace(blended)
+
+    # Alpha-composite the overlay over the base
+    blended *= coverage
+    base_term = base.astype(np.uint16)
+    base_term *= 255 - coverage
+    blended += base_term
+    blended += 127
+    _div255_inplace(blended)
+
+    base[...] = blended
+
+
+def composite_layer(base, layer, position, alpha_lut):
+    """Blend layer onto a copy of base at position and return an RGB image"""
+    if base.mode != 'RGB':
+        base = base.convert('RGB')
+    target = np.array(base)
+    blend_into(target, layer, position, alpha_lut)
+    return Image.fromarray(target)
+
+
+def _feather_ramp(length, start, end, feather):
+    """Weights that are 1 on [start, end) and fade to 0 over feather positions on either side"""
+    positions = np.arange(length, dtype=np.float32)
+    distance = np.maximum(np.maximum(start - positions, positions - (end - 1)), 0)
+    return np.clip(1.0 - distance / (feather + 1.0), 0.0, 1.0)
+
+
+def enhance_region(target, layer_size, position, chain, feather=None):
+    """
+    Apply an EnhancementChain to a uint8 RGB array in place, only over the
+    footprint of a layer placed at position plus a feather margin across
+    which the effect fades out. The rest of the frame is never touched, and
+    the region is processed in the chain's row bands.
+    """
+    height, width = target.shape[:2]
+    regions = _clip_region((width, height), layer_size, position)
+    if regions is None or chain.is_identity():
+        return target
+    rows, cols = regions[0]
+    if feather is None:
+        feather = max(4, min(width, height) // 32)
+
+    top, bottom = max(rows.start - feather, 0), min(rows.stop + feather, height)
+    left, right = max(cols.start - feather, 0), min(cols.stop + feather, width)
+    region = target[top:bottom, left:right]
+    row_weights = _feather_ramp(bottom - top, rows.start - top, rows.stop - top, feather)
+    col_weights = _feather_ramp(right - left, cols.start - left, cols.stop - left, feather)
+
+    for start, stop, enhanced in chain.iter_bands(region):
+        _feather_into(region[start:stop], enhanced, row_weights[start:stop], col_weights,
+                      cols.start - left, cols.stop - left)
+    return target
+
+
+def _feather_into(band, enhanced, row_weights, col_weights, inner_left, inner_right):
+    """
+    Write enhanced into band, weighted by row_weights x col_weights. Where
+    both weights are 1 (inside the footprint) the effect applies fully and
+    is copied; only the margin strips are blended.
+    """
+    inside = np.flatnonzero(row_weights >= 1.0)
+    inner_top, inner_bottom = (inside[0], inside[-1] + 1) if inside.size else (0, 0)
+    strips = [
+        (slice(0, inner_top), slice(None)),
+        (slice(inner_bottom, None), slice(None)),
+        (slice(inner_top, inner_bottom), slice(0, inner_left)),
+        (slice(inner_top, inner_bottom), slice(inner_right, None)),
+    ]
+    for strip in strips:
+        original = band[strip]
+        if original.size:
+            blended = enhanced[strip].astype(np.float32)
+            blended -= original
+            blended *= (row_weights[strip[0], None] * col_weights[None, strip[1]])[..., None]
+            blended += original
+            blended += 0.5
+            original[...] = blended.astype(np.uint8)
+    band[inner_top:inner_bottom, inner_left:inner_right] = \
+        enhanced[inner_top:inner_bottom, inner_left:inner_right]
+
+
+def build_overlay(size, layer, position, alpha_lut):
+    """
+    Build the transparent RGBA overlay that pasting layer at position through
+    its scaled alpha would produce, for callers that composite it later
+    """
+    overlay = np.zeros((size[1], size[0], 4), dtype=np.uint8)
+    regions = _clip_region(size, layer.size, position)
+    if regions is None:
+        return Image.fromarray(overlay, 'RGBA')
+    base_region, layer_region = regions
+
+    rgb, alpha = _layer_arrays(layer, alpha_lut)
+    rgb = rgb[layer_region]
+    if np.isscalar(alpha):
+        alpha = np.full(rgb.shape[:2], alpha, dtype=np.uint16)
+    else:
+        alpha = alpha[layer_region].astype(np.uint16)
+
+    region = overlay[base_region]
+    region[..., :3] = _div255_inplace(rgb * alpha[..., None] + 127)
+    region[..., 3] = _PASTE_COVERAGE_LUT[alpha]
+    return Image.fromarray(overlay, 'RGBA')
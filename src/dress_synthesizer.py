@@ -1,114 +1,356 @@
-import google.generativeai as genai
-from PIL import Image, ImageEnhance, ImageFilter
+from PIL import Image
+import numpy as np
+import asyncio
+import concurrent.futures
 import io
-import base64
+import json
+import logging
+import threading
+import weakref
 import time
-import streamlit as st
-import numpy as np
+from collections import OrderedDict
+from .cache import image_digest, make_cache_key
+from .image_handles import is_stale_handle_error
+from .enhance import EnhancementChain
+from .quality import DEFAULT_QUALITY, get_quality_profile, resample_filter
+from .generation import build_generation_profiles, generation_config_for
+from .resilience import CircuitOpenError, ResiliencePolicy
+from .metrics import METRICS
+from .landmarks import LANDMARKS
+from .compositor import (
+    BODY_COMPOSITE_LUT, DRESS_OVERLAY_LUT, SIMPLE_OVERLAY_LUT, blend_into, build_overlay,
+    composite_layer, enhance_region
+)
+
+logger = logging.getLogger(__name__)
+
+# Allowed values for the fitting attributes used by the compositing pipeline
+FITTING_ATTRIBUTE_VALUES = {
+    'body_type': ['slim', 'average', 'curvy', 'athletic'],
+    'dress_fit': ['tight', 'regular', 'loose'],
+    'dress_style': ['short', 'midi', 'regular', 'long'],
+    'dress_position': ['shoulders', 'chest', 'waist'],
+    'fabric_behavior': ['flowing', 'normal', 'structured'],
+}
+
+# Keyword rules per fitting attribute, in priority order: an earlier rule
+# wins over a later one wherever they appear in the text
+FITTING_KEYWORD_RULES = [
+    ('body_type', [
+        ('slim', ['slim', 'slender', 'thin', 'lean']),
+        ('curvy', ['curvy', 'full', 'plus-size', 'voluptuous']),
+        ('athletic', ['athletic', 'muscular', 'toned']),
+    ]),
+    ('dress_fit', [
+        ('tight', ['tight', 'fitted', 'snug', 'form-fitting']),
+        ('loose', ['loose', 'flowing', 'relaxed', 'baggy']),
+    ]),
+    ('dress_style', [
+        ('short', ['short', 'mini', 'above knee']),
+        ('long', ['long', 'maxi', 'floor-length', 'ankle']),
+        ('midi', ['midi', 'knee-length', 'below knee']),
+    ]),
+    ('dress_position', [
+        ('shoulders', ['shoulder', 'neckline', 'collar']),
+        ('chest', ['chest', 'bust', 'breast']),
+        ('waist', ['waist', 'waistline', 'middle']),
+    ]),
+    ('fabric_behavior', [
+        ('flowing', ['drape', 'flow', 'cascade', 'fall']),
+        ('structured', ['structured', 'stiff', 'rigid']),
+    ]),
+]
+
+_MAX_KEYWORD_LENGTH = max(
+    len(word) for _, rules in FITTING_KEYWORD_RULES for _, words in rules for word in words
+)
+
+
+class FittingParser:
+    """
+    Extracts fitting attributes from model text, incrementally if needed.
+    Feed streamed chunks as they arrive; an attribute is settled once its
+    highest-priority keyword has been seen, since later text cannot change it.
+    """
+    
+    def __init__(self):
+        self._tail = ''
+        self._best = {}  # attribute -> index of the best matching rule so far
+    
+    def feed(self, text):
+        """Scan a chunk of text, including keywords split across chunk boundaries"""
+        window = self._tail + text.lower()
+        self._tail = window[-(_MAX_KEYWORD_LENGTH - 1):]
+        
+        for attribute, rules in FITTING_KEYWORD_RULES:
+            best = self._best.get(attribute, len(rules))
+            for index in range(best):
+                if any(word in window for word in rules[index][1]):
+                    self._best[attribute] = index
+                    break
+    
+    def is_settled(self, attribute):
+        return self._best.get(attribute) == 0
+    
+    @property
+    def settled(self):
+        """True once no further text can change any fitting attribute"""
+        return all(self.is_settled(attribute) for attribute, _ in FITTING_KEYWORD_RULES)
+    
+    def fitting_info(self):
+        """Return the fitting attributes found so far, with defaults for the rest"""
+        fitting_info = {
+            'body_type': 'average',
+            'dress_fit': 'regular',
+            'dress_style': 'regular',
+            'dress_position': 'chest',
+            'color_match': 'good',
+            'style_compatibility': 'high',
+            'fabric_behavior': 'normal',
+            'suggested_adjustments': []
+        }
+        for attribute, rules in FITTING_KEYWORD_RULES:
+            if attribute in self._best:
+                fitting_info[attribute] = rules[self._best[attribute]][0]
+        return fitting_info
+
+
+STYLING_CATEGORIES = [
+    ('accessories', 'Recommended accessories'),
+    ('shoes', 'Shoe suggestions'),
+    ('hair_and_makeup', 'Hair and makeup'),
+    ('color_tips', 'Color coordination tips'),
+    ('occasions', 'Occasion suitability'),
+]
+
+FUSED_ANALYSIS_PROMPT = """
+You are an expert fashion stylist and virtual try-on specialist.
+IMAGE 1 is a person and IMAGE 2 is a dress. Analyze how this dress would fit
+and look on this person, and answer with a single JSON object of this shape:
+
+{
+  "body_type": "slim" | "average" | "curvy" | "athletic",
+  "dress_fit": "tight" | "regular" | "loose",
+  "dress_style": "short" | "midi" | "regular" | "long",
+  "dress_position": "shoulders" | "chest" | "waist",
+  "fabric_behavior": "flowing" | "normal" | "structured",
+  "color_match": short phrase,
+  "style_compatibility": "low" | "medium" | "high",
+  "suggested_adjustments": [short strings],
+  "compatibility_score": integer from 1 to 10,
+  "compatibility_analysis": a few sentences on color coordination, style, fit and overall appeal,
+  "styling_suggestions": {
+    "accessories": [short strings],
+    "shoes": [short strings],
+    "hair_and_makeup": [short strings],
+    "color_tips": [short strings],
+    "occasions": [short strings]
+  },
+  "visual_description": two or three sentences describing the person wearing the dress
+}
+
+Return only the JSON object.
+"""
+
+# Per-image analyses used by the 'split' analysis mode. Each depends on one
+# image only, so it is made once per person or dress and reused across pairs.
+PERSON_ANALYSIS_PROMPT = """
+You are an expert fashion stylist and virtual try-on specialist.
+The image is a person who will virtually try on dresses. Describe the person,
+not their current clothing, as a single JSON object of this shape:
+
+{
+  "body_type": "slim" | "average" | "curvy" | "athletic",
+  "skin_tone": short phrase,
+  "pose": short phrase
+}
+
+Return only the JSON object.
+"""
+
+DRESS_ANALYSIS_PROMPT = """
+You are an expert fashion stylist and virtual try-on specialist.
+The image is a dress. Describe how it is cut and worn as a single JSON object
+of this shape:
+
+{
+  "dress_fit": "tight" | "regular" | "loose",
+  "dress_style": "short" | "midi" | "regular" | "long",
+  "dress_position": "shoulders" | "chest" | "waist",
+  "fabric_behavior": "flowing" | "normal" | "structured",
+  "colors": [short strings],
+  "visual_description": one or two sentences on the dress's colors, fabric and drape
+}
+
+Return only the JSON object.
+"""
+
+SPLIT_ANALYSIS_PROMPTS = {
+    'person': PERSON_ANALYSIS_PROMPT,
+    'dress': DRESS_ANALYSIS_PROMPT,
+}
 
 class DressSynthesizer:
     """Handles AI-powered dress try-on synthesis using Google Gemini"""
     
-    def __init__(self, model):
+    def __init__(self, model, cache=None, analysis_mode='standard', max_concurrency=4,
+                 image_store=None, catalog=None, quality=DEFAULT_QUALITY,
+                 generation_overrides=None, resilience=None, metrics=None, landmarks=None):
         self.model = model
-        self.generation_config = {
-            "temperature": 0.7,
-            "top_p": 0.8,
-            "top_k": 40,
-            "max_output_tokens": 1000,
-        }
+        self.cache = cache  # Optional ResultCache shared across requests
+        self.image_store = image_store  # Optional ImageHandleStore for upload-once images
+        self.catalog = catalog  # Optional DressCatalog with precompiled dress assets
+        self.quality = quality  # "Output Quality" profile name, see quality.py
+        # 'standard' makes separate calls per feature, 'fused' makes one structured
+        # call per pair, 'split' makes one per person and one per dress
+        self.analysis_mode = analysis_mode
+        self.max_concurrency = max_concurrency  # Concurrent model calls in the async API
+        self._fused_results = OrderedDict()
+        self._fused_inflight = {}
+        self._fused_lock = threading.Lock()
+        self._split_results = OrderedDict()  # (kind, image digest) -> person or dress analysis
+        self._split_inflight = {}
+        self._split_lock = threading.Lock()
+        self._split_executor = None  # Runs the person analysis beside the dress one, see analyze_pair
+        self._semaphores = weakref.WeakKeyDictionary()
+        # Token ceiling, temperature and model per call type, see generation.py
+        self.generation_profiles = build_generation_profiles(generation_overrides)
+        self._profile_models = {}
+        # Deadlines, retries, hedging and circuit breaker; share one across requests
+        self.resilience = resilience or ResiliencePolicy()
+        self.metrics = metrics or METRICS  # Timing spans and counters, see metrics.py
+        self.landmarks = landmarks or LANDMARKS  # Cached body landmarks, see landmarks.py
+        self.last_error = None  # Message of the most recent AI processing failure
     
     def generate_try_on(self, human_image, dress_image):
         """
         Generate virtual try-on using Gemini's advanced image understanding and description,
-        then create a realistic composite based on AI analysis
+        then create a realistic composite based on AI analysis.
+        AI failures are logged and kept in last_error; a fallback composite is returned.
         """
+        result_image, _ = self.generate_try_on_checked(human_image, dress_image)
+        return result_image
+    
+    def generate_try_on_checked(self, human_image, dress_image):
+        """
+        Like generate_try_on, but returns (result_image, error). error is None
+        unless AI processing failed and the fallback composite was returned.
+        """
+        return self.render_try_on(human_image, dress_image, self.plan_try_on(human_image, dress_image))
+    
+    def plan_try_on(self, human_image, dress_image):
+        """
+        Run the model half of a try-on: the analysis calls, and nothing else.
+        Returns a plan for render_try_on, a small picklable dict with 'path'
+        ('model', 'local' or 'fallback'), 'fitting_info', 'description' and
+        'error'.
+        """
+        if not self._use_model():
+            return {'path': 'local', 'fitting_info': None, 'description': '', 'error': None}
+        
+        deadline = self.resilience.new_deadline()
         try:
-            # Convert images to format suitable for Gemini
-            human_image_data = self._prepare_image_for_gemini(human_image)
-            dress_image_data = self._prepare_image_for_gemini(dress_image)
+            if self.analysis_mode in ('fused', 'split'):
+                if self.analysis_mode == 'fused':
+                    analysis = self.analyze_fused(human_image, dress_image)
+                else:
+                    analysis = self.combine_analyses(*self.analyze_pair(human_image, dress_image, deadline))
+                return {
+                    'path': 'model',
+                    'fitting_info': self._parse_ai_description(analysis),
+                    'description': analysis['visual_description'],
+                    'error': None,
+                }
             
             # Step 1: Get detailed body and dress analysis
-            analysis_prompt = """
-            Analyze these two images for virtual try-on:
-            
-            IMAGE 1 (Person):
-            - Estimate body measurements and proportions
-            - Identify pose and body position
-            - Note skin tone and facial features
-            - Determine body type (slim, average, curvy, etc.)
-            
-            IMAGE 2 (Dress):
-            - Identify dress style, cut, and silhouette
-            - Note fabric type and drape characteristics
-            - Determine size and fit style (tight, loose, flowing)
-            - Analyze colors and patterns
-            
-            FITTING ANALYSIS:
-            - How would this dress fit this person's body?
-            - Where would the dress sit (neckline, waist, hem)?
-            - How would it drape and flow on their figure?
-            - What adjustments would be needed for perfect fit?
-            
-            Provide specific, technical details for realistic virtual fitting.
-            """
+            analysis_prompt = self._create_analysis_prompt()
             
             # Get AI analysis
-            analysis_response = self.model.generate_content([
-                analysis_prompt,
-                human_image_data,
-                dress_image_data
-            ])
+            analysis_text = self._generate_text(
+                analysis_prompt, [human_image, dress_image], 'analysis', deadline
+            )
             
             # Step 2: Generate virtual try-on visualization prompt
-            visualization_prompt = f"""
-            Based on this analysis: {analysis_response.text}
-            
-            Now describe EXACTLY how this person would look wearing this dress:
-            
-            VISUAL COMPOSITION:
-            - Person wearing the dress in the same pose as the original photo
-            - Dress properly fitted to their body shape and size
-            - Natural draping and fabric behavior
-            - Proper proportions and positioning
-            
-            REALISTIC DETAILS:
-            - How the dress would look from this viewing angle
-            - Shadow and lighting effects on the fabric
-            - Natural wrinkles and fabric folds
-            - Color interaction with skin tone
-            - Overall styling and aesthetic appeal
-            
-            Describe this as if you're looking at a real photograph of this person wearing this exact dress.
-            Be extremely detailed and specific about the visual result.
-            """
+            visualization_prompt = self._create_visualization_prompt(analysis_text)
             
             # Get detailed visualization
-            visualization_response = self.model.generate_content([
-                visualization_prompt,
-                human_image_data,
-                dress_image_data
-            ])
-            
-            # Create enhanced virtual try-on using AI insights
-            result_image = self._create_ai_guided_try_on(
-                human_image, 
-                dress_image, 
-                visualization_response.text,
-                analysis_response.text
+            visualization_text = self._generate_text(
+                visualization_prompt, [human_image, dress_image], 'visualization', deadline
             )
             
-            return result_image
+            # Parse AI descriptions for detailed fitting information
+            return {
+                'path': 'model',
+                'fitting_info': self._parse_ai_description(visualization_text + " " + analysis_text),
+                'description': visualization_text,
+                'error': None,
+            }
             
+        except CircuitOpenError:
+            # The API is degraded; fit locally instead of waiting on it
+            return {'path': 'local', 'fitting_info': None, 'description': '', 'error': None}
         except Exception as e:
-            st.error(f"Error in AI processing: {str(e)}")
+            error = f"Error in AI processing: {str(e)}"
+            self._report_error(error)
+            return {'path': 'fallback', 'fitting_info': None, 'description': '', 'error': error}
+    
+    def render_try_on(self, human_image, dress_image, plan):
+        """
+        Render a plan from plan_try_on; CPU work only, no model calls, so it
+        can run in another thread or process. Returns (result_image, error).
+        """
+        if plan['path'] == 'local':
+            return self._create_local_try_on(human_image, dress_image), None
+        if plan['path'] == 'fallback':
+            return self._create_advanced_composite(human_image, dress_image), plan['error']
+        
+        try:
+            self._count_result('model')
+            # Create enhanced virtual try-on using AI insights
+            result_image = self._create_realistic_try_on(
+                human_image, dress_image, plan['fitting_info'], plan['description']
+            )
+            return result_image, None
+        except Exception as e:
+            error = f"Error in AI processing: {str(e)}"
+            self._report_error(error)
             # Return a fallback composite image
-            return self._create_advanced_composite(human_image, dress_image)
+            return self._create_advanced_composite(human_image, dress_image), error
+    
+    def _report_error(self, message):
+        self.last_error = message
+        logger.warning(message)
+    
+    def _profile(self):
+        return get_quality_profile(self.quality)
+    
+    def _use_model(self):
+        """True if this request should call the model rather than fit locally"""
+        return self._profile()['use_model'] and self.resilience.available()
+    
+    def _count_result(self, path):
+        """Count a finished try-on by how it was produced: model, local or fallback"""
+        self.metrics.inc('tryon_results_total', path=path)
+    
+    def _create_local_try_on(self, human_image, dress_image):
+        """Fit and composite with default fitting attributes, without calling the model"""
+        self._count_result('local')
+        fitting_info = self._parse_ai_description("")
+        return self._create_realistic_try_on(human_image, dress_image, fitting_info, "")
+    
+    def _create_fused_try_on(self, human_image, dress_image, analysis):
+        """Fit and composite from a structured (fused) analysis"""
+        self._count_result('model')
+        fitting_info = self._parse_ai_description(analysis)
+        return self._create_realistic_try_on(
+            human_image, dress_image, fitting_info, analysis['visual_description']
+        )
     
     def _create_advanced_composite(self, human_image, dress_image):
         """
         Create an advanced composite image as fallback
         """
+        self._count_result('fallback')
         # Create side-by-side with arrow indicating transformation
         total_width = human_image.width + dress_image.width + 100
         max_height = max(human_image.height, dress_image.height)
@@ -138,33 +380,15 @@ class DressSynthesizer:
         
         dress_resized = dress_image.resize(
             (dress_width, dress_height), 
-            Image.Resampling.LANCZOS
+            resample_filter(self._profile())
         )
         
-        # Create overlay
-        result = human_image.copy()
-        overlay = Image.new('RGBA', result.size, (0, 0, 0, 0))
-        
         # Position dress
-        dress_x = (result.width - dress_width) // 2
-        dress_y = int(result.height * 0.2)
+        dress_x = (human_image.width - dress_width) // 2
+        dress_y = int(human_image.height * 0.2)
         
-        # Convert and blend
-        if dress_resized.mode != 'RGBA':
-            dress_resized = dress_resized.convert('RGBA')
-            
-        # Make semi-transparent
-        alpha = dress_resized.split()[-1]
-        alpha = alpha.point(lambda p: p * 0.7)
-        dress_resized.putalpha(alpha)
-        
-        overlay.paste(dress_resized, (dress_x, dress_y), dress_resized)
-        
-        # Composite
-        result_rgba = result.convert('RGBA')
-        final = Image.alpha_composite(result_rgba, overlay)
-        
-        return final.convert('RGB')
+        # Blend semi-transparent dress in a single vectorized pass
+        return composite_layer(human_image, dress_resized, (dress_x, dress_y), SIMPLE_OVERLAY_LUT)
     
     def _create_try_on_prompt(self):
         """Create a detailed prompt for virtual try-on"""
@@ -185,12 +409,533 @@ class DressSynthesizer:
         Be specific and detailed in your description.
         """
     
+    def _create_analysis_prompt(self):
+        """Create the combined body and dress analysis prompt"""
+        return """
+        Analyze these two images for virtual try-on:
+        
+        IMAGE 1 (Person):
+        - Estimate body measurements and proportions
+        - Identify pose and body position
+        - Note skin tone and facial features
+        - Determine body type (slim, average, curvy, etc.)
+        
+        IMAGE 2 (Dress):
+        - Identify dress style, cut, and silhouette
+        - Note fabric type and drape characteristics
+        - Determine size and fit style (tight, loose, flowing)
+        - Analyze colors and patterns
+        
+        FITTING ANALYSIS:
+        - How would this dress fit this person's body?
+        - Where would the dress sit (neckline, waist, hem)?
+        - How would it drape and flow on their figure?
+        - What adjustments would be needed for perfect fit?
+        
+        Provide specific, technical details for realistic virtual fitting.
+        """
+    
+    def _create_visualization_prompt(self, analysis_text):
+        """Create the visualization prompt that builds on a previous analysis"""
+        return f"""
+        Based on this analysis: {analysis_text}
+        
+        Now describe EXACTLY how this person would look wearing this dress:
+        
+        VISUAL COMPOSITION:
+        - Person wearing the dress in the same pose as the original photo
+        - Dress properly fitted to their body shape and size
+        - Natural draping and fabric behavior
+        - Proper proportions and positioning
+        
+        REALISTIC DETAILS:
+        - How the dress would look from this viewing angle
+        - Shadow and lighting effects on the fabric
+        - Natural wrinkles and fabric folds
+        - Color interaction with skin tone
+        - Overall styling and aesthetic appeal
+        
+        Describe this as if you're looking at a real photograph of this person wearing this exact dress.
+        Answer in one short paragraph naming the fit, length, neckline and waist
+        position, fabric drape and colors; this guides an automatic composite.
+        """
+    
+    def _create_compatibility_prompt(self):
+        """Create the style compatibility prompt"""
+        return """
+        Analyze the compatibility between this person and this dress/clothing item.
+        Consider:
+        1. Color coordination
+        2. Style compatibility
+        3. Fit predictions
+        4. Overall aesthetic appeal
+        5. Suggestions for improvement
+        
+        Provide a detailed analysis with a compatibility score (1-10).
+        """
+    
+    def _create_styling_prompt(self):
+        """Create the styling suggestions prompt"""
+        return """
+        Based on this person and dress combination, provide styling suggestions:
+        1. Recommended accessories
+        2. Shoe suggestions
+        3. Hair and makeup recommendations
+        4. Color coordination tips
+        5. Occasion suitability
+        
+        Be specific and practical in your suggestions.
+        """
+    
+    def analyze_fused(self, human_image, dress_image):
+        """
+        Run one structured analysis call covering fitting, compatibility and styling.
+        Results are kept per image pair so every feature reads the same object.
+        """
+        pair_key = (image_digest(human_image), image_digest(dress_image))
+        analysis = self._cached_fused(pair_key)
+        if analysis is not None:
+            return analysis
+        
+        analysis = self._generate_text(
+            FUSED_ANALYSIS_PROMPT, [human_image, dress_image], 'fused', parse=self._parse_fused
+        )
+        return self._remember_fused(pair_key, analysis)
+    
+    async def analyze_fused_async(self, human_image, dress_image):
+        """Async variant of analyze_fused; concurrent callers share one request"""
+        pair_key = (image_digest(human_image), image_digest(dress_image))
+        analysis = self._cached_fused(pair_key)
+        if analysis is not None:
+            return analysis
+        
+        task = self._fused_inflight.get(pair_key)
+        if task is None:
+            task = asyncio.ensure_future(self._generate_text_async(
+                FUSED_ANALYSIS_PROMPT, [human_image, dress_image], 'fused', parse=self._parse_fused
+            ))
+            self._fused_inflight[pair_key] = task
+        
+        try:
+            analysis = await asyncio.shield(task)
+        finally:
+            if task.done():
+                self._fused_inflight.pop(pair_key, None)
+        
+        return self._cached_fused(pair_key) or self._remember_fused(pair_key, analysis)
+    
+    def _cached_fused(self, pair_key):
+        with self._fused_lock:
+            if pair_key in self._fused_results:
+                self._fused_results.move_to_end(pair_key)
+                return self._fused_results[pair_key]
+        return None
+    
+    def _parse_fused(self, text):
+        return self._normalize_fused_analysis(self._load_json_response(text))
+    
+    def _remember_fused(self, pair_key, analysis):
+        with self._fused_lock:
+            self._fused_results[pair_key] = analysis
+            while len(self._fused_results) > 32:
+                self._fused_results.popitem(last=False)
+        
+        return analysis
+    
+    def analyze_person(self, human_image, deadline=None):
+        """Return the structured analysis of a person, made once per image and reused across dresses"""
+        return self._analyze_split('person', human_image, deadline)
+    
+    def analyze_dress(self, dress_image, deadline=None):
+        """Return the structured analysis of a dress, made once per image and reused across people"""
+        return self._analyze_split('dress', dress_image, deadline)
+    
+    async def analyze_person_async(self, human_image, deadline=None):
+        """Async variant of analyze_person; concurrent callers share one request"""
+        return await self._analyze_split_async('person', human_image, deadline)
+    
+    async def analyze_dress_async(self, dress_image, deadline=None):
+        """Async variant of analyze_dress; concurrent callers share one request"""
+        return await self._analyze_split_async('dress', dress_image, deadline)
+    
+    def analyze_pair(self, human_image, dress_image, deadline=None):
+        """Run analyze_person and analyze_dress concurrently; returns (person, dress)"""
+        with self._split_lock:
+            if self._split_executor is None:
+                self._split_executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_concurrency, thread_name_prefix='split-analysis'
+                )
+            executor = self._split_executor
+        person = executor.submit(self.analyze_person, human_image, deadline)
+        dress = self.analyze_dress(dress_image, deadline)
+        return person.result(), dress
+    
+    def combine_analyses(self, person, dress):
+        """
+        Combine a person and a dress analysis into the fitting fields of a
+        fused analysis. This is a local step; it makes no model call.
+        """
+        analysis = self._parse_ai_description({
+            'body_type': person.get('body_type'),
+            'dress_fit': dress.get('dress_fit'),
+            'dress_style': dress.get('dress_style'),
+            'dress_position': dress.get('dress_position'),
+            'fabric_behavior': dress.get('fabric_behavior'),
+        })
+        analysis['visual_description'] = str(dress.get('visual_description', ''))
+        return analysis
+    
+    async def _structured_analysis_async(self, human_image, dress_image, deadline=None):
+        """Return the fused analysis, or the combined split analyses, for the current mode"""
+        if self.analysis_mode == 'fused':
+            return await self.analyze_fused_async(human_image, dress_image)
+        person, dress = await asyncio.gather(
+            self.analyze_person_async(human_image, deadline),
+            self.analyze_dress_async(dress_image, deadline)
+        )
+        return self.combine_analyses(person, dress)
+    
+    def _cached_split(self, key):
+        with self._split_lock:
+            if key in self._split_results:
+                self._split_results.move_to_end(key)
+                return self._split_results[key]
+        return None
+    
+    def _analyze_split(self, kind, image, deadline=None):
+        key = (kind, image_digest(image))
+        analysis = self._cached_split(key)
+        if analysis is not None:
+            return analysis
+        
+        analysis = self._generate_text(
+            SPLIT_ANALYSIS_PROMPTS[kind], [image], kind, deadline, parse=self._load_json_response
+        )
+        return self._remember_split(key, analysis)
+    
+    async def _analyze_split_async(self, kind, image, deadline=None):
+        key = (kind, image_digest(image))
+        analysis = self._cached_split(key)
+        if analysis is not None:
+            return analysis
+        
+        task = self._split_inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._generate_text_async(
+                SPLIT_ANALYSIS_PROMPTS[kind], [image], kind, deadline, parse=self._load_json_response
+            ))
+            self._split_inflight[key] = task
+        
+        try:
+            analysis = await asyncio.shield(task)
+        finally:
+            if task.done():
+                self._split_inflight.pop(key, None)
+        
+        return self._cached_split(key) or self._remember_split(key, analysis)
+    
+    def _remember_split(self, key, analysis):
+        with self._split_lock:
+            self._split_results[key] = analysis
+            while len(self._split_results) > 256:
+                self._split_results.popitem(last=False)
+        
+        return analysis
+    
+    def _load_json_response(self, text):
+        """Parse a JSON model response, tolerating Markdown code fences"""
+        cleaned = text.strip()
+        if cleaned.startswith('```'):
+            cleaned = cleaned.strip('`')
+            if cleaned.lower().startswith('json'):
+                cleaned = cleaned[4:]
+        
+        data = json.loads(cleaned)
+        if not isinstance(data, dict):
+            raise ValueError("Expected a JSON object in the model response")
+        return data
+    
+    def _normalize_fused_analysis(self, data):
+        """Fill in defaults so callers can rely on every field of a fused analysis"""
+        analysis = self._parse_ai_description(data)
+        
+        try:
+            score = int(data.get('compatibility_score', 0))
+        except (TypeError, ValueError):
+            score = 0
+        analysis['compatibility_score'] = max(1, min(score, 10)) if score else None
+        analysis['compatibility_analysis'] = str(data.get('compatibility_analysis', ''))
+        analysis['visual_description'] = str(data.get('visual_description', ''))
+        
+        suggestions = data.get('styling_suggestions')
+        if not isinstance(suggestions, dict):
+            suggestions = {}
+        analysis['styling_suggestions'] = {
+            key: self._as_string_list(suggestions.get(key)) for key, _ in STYLING_CATEGORIES
+        }
+        
+        return analysis
+    
+    def _as_string_list(self, value):
+        if value is None:
+            return []
+        if isinstance(value, (list, tuple)):
+            return [str(item) for item in value if str(item).strip()]
+        return [str(value)]
+    
+    def _format_compatibility(self, analysis):
+        """Render the compatibility part of a fused analysis as Markdown"""
+        lines = []
+        if analysis['compatibility_score'] is not None:
+            lines.append(f"**Compatibility score:** {analysis['compatibility_score']}/10")
+        lines.append(f"**Color match:** {analysis['color_match']}")
+        lines.append(f"**Style compatibility:** {analysis['style_compatibility']}")
+        if analysis['compatibility_analysis']:
+            lines.append(analysis['compatibility_analysis'])
+        if analysis['suggested_adjustments']:
+            lines.append("**Suggested adjustments:**")
+            lines.extend(f"- {item}" for item in analysis['suggested_adjustments'])
+        return "\n\n".join(lines)
+    
+    def _format_styling(self, analysis):
+        """Render the styling part of a fused analysis as Markdown"""
+        sections = []
+        for key, title in STYLING_CATEGORIES:
+            items = analysis['styling_suggestions'].get(key)
+            if items:
+                bullets = "\n".join(f"- {item}" for item in items)
+                sections.append(f"**{title}:**\n{bullets}")
+        return "\n\n".join(sections) or "No styling suggestions were returned."
+    
+    def _generate_text(self, prompt, images, call_type, deadline=None, parse=None):
+        """
+        Run a text generation call with the generation profile for call_type,
+        serving repeats from the result cache. The call runs under the
+        resilience policy, within deadline (a time.monotonic() value) if given.
+        parse, if given, turns the reply into the return value; a reply it
+        rejects is raised and never cached.
+        """
+        model, generation_config = self._generation_settings(call_type)
+        digests = [image_digest(image) for image in images]
+        cache_key, cached = self._lookup_cached(model, prompt, digests, generation_config)
+        if cached is not None:
+            parsed = self._parse_cached(cached, parse)
+            if parsed is not None:
+                return parsed
+        
+        def attempt(timeout):
+            request_options = {'timeout': timeout}
+            try:
+                response = model.generate_content(
+                    self._build_contents(prompt, images, digests),
+                    generation_config=generation_config, request_options=request_options
+                )
+            except Exception as e:
+                if not self._refresh_handles(digests, e):
+                    raise
+                # A stale file handle was rejected; retry once with fresh uploads
+                response = model.generate_content(
+                    self._build_contents(prompt, images, digests),
+                    generation_config=generation_config, request_options=request_options
+                )
+            return response.text
+        
+        with self.metrics.span('model_call_seconds', call_type=call_type):
+            text = self.resilience.call(attempt, deadline)
+        
+        result = text if parse is None else parse(text)
+        self._store_cached(cache_key, text)
+        return result
+    
+    async def _generate_text_async(self, prompt, images, call_type, deadline=None, parse=None):
+        """Async variant of _generate_text, bounded by the concurrency semaphore"""
+        model, generation_config = self._generation_settings(call_type)
+        digests = [image_digest(image) for image in images]
+        cache_key, cached = self._lookup_cached(model, prompt, digests, generation_config)
+        if cached is not None:
+            parsed = self._parse_cached(cached, parse)
+            if parsed is not None:
+                return parsed
+        
+        async def attempt(timeout):
+            request_options = {'timeout': timeout}
+            contents = await asyncio.to_thread(self._build_contents, prompt, images, digests)
+            try:
+                response = await model.generate_content_async(
+                    contents, generation_config=generation_config, request_options=request_options
+                )
+            except Exception as e:
+                if not self._refresh_handles(digests, e):
+                    raise
+                contents = await asyncio.to_thread(self._build_contents, prompt, images, digests)
+                response = await model.generate_content_async(
+                    contents, generation_config=generation_config, request_options=request_options
+                )
+            return response.text
+        
+        async with self._get_semaphore():
+            with self.metrics.span('model_call_seconds', call_type=call_type):
+                text = await self.resilience.call_async(attempt, deadline)
+        
+        result = text if parse is None else parse(text)
+        self._store_cached(cache_key, text)
+        return result
+    
+    async def _stream_text_async(self, prompt, images, call_type, deadline=None):
+        """
+        Async generator over the response text of a streamed generation call.
+        Cache hits are yielded as a single chunk; misses are cached once complete.
+        Streams are neither retried nor hedged once text has been yielded, but
+        they honour the circuit breaker and the latency budget.
+        """
+        model, generation_config = self._generation_settings(call_type)
+        digests = [image_digest(image) for image in images]
+        cache_key, cached = self._lookup_cached(model, prompt, digests, generation_config)
+        if cached is not None:
+            yield cached
+            return
+        
+        self.resilience.guard()
+        timeout = self.resilience.call_timeout
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+        request_options = {'timeout': timeout}
+        
+        parts = []
+        outcome_recorded = False
+        try:
+            async with self._get_semaphore():
+                started = time.perf_counter()
+                try:
+                    contents = await asyncio.to_thread(self._build_contents, prompt, images, digests)
+                    try:
+                        response = await model.generate_content_async(
+                            contents, generation_config=generation_config,
+                            request_options=request_options, stream=True
+                        )
+                    except Exception as e:
+                        if not self._refresh_handles(digests, e):
+                            raise
+                        contents = await asyncio.to_thread(self._build_contents, prompt, images, digests)
+                        response = await model.generate_content_async(
+                            contents, generation_config=generation_config,
+                            request_options=request_options, stream=True
+                        )
+                    
+                    async for chunk in response:
+                        text = chunk.text
+                        if text:
+                            parts.append(text)
+                            yield text
+                except Exception as e:
+                    outcome_recorded = True
+                    self.resilience.record(e)
+                    raise
+                outcome_recorded = True
+                self.resilience.record()
+                self.metrics.observe('model_call_seconds', time.perf_counter() - started, call_type=call_type)
+        finally:
+            if not outcome_recorded:
+                # Closed or cancelled mid-stream (a rerun, say): give back a half-open trial slot
+                self.resilience.release()
+        
+        self._store_cached(cache_key, ''.join(parts))
+    
+    def _generation_settings(self, call_type):
+        """Return (model, generation_config) for a call type's generation profile"""
+        profile = self.generation_profiles[call_type]
+        model = profile.get('model')
+        if model is None:
+            model = self.model
+        elif isinstance(model, str):
+            # Named models are created once and reused for every call
+            if model not in self._profile_models:
+                import google.generativeai as genai
+                
+                self._profile_models[model] = genai.GenerativeModel(model)
+            model = self._profile_models[model]
+        return model, generation_config_for(profile)
+    
+    def _get_semaphore(self):
+        """Return the concurrency semaphore for the running event loop"""
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphores[loop] = semaphore
+        return semaphore
+    
+    def _build_contents(self, prompt, images, digests):
+        """Build the request parts, reusing uploaded handles when a store is configured"""
+        if self.image_store is None:
+            parts = [self._prepare_image_for_gemini(image) for image in images]
+        else:
+            parts = [
+                self.image_store.get_part(digest, image, self._prepare_image_for_gemini)
+                for digest, image in zip(digests, images)
+            ]
+        
+        # Uploaded handles cost only a reference; inline parts carry the image bytes
+        sent = len(prompt.encode('utf-8')) + sum(
+            len(part['data']) for part in parts if isinstance(part, dict)
+        )
+        self.metrics.inc('model_request_bytes_total', sent)
+        return [prompt] + parts
+    
+    def _refresh_handles(self, digests, error):
+        """
+        Drop uploaded handles after a call failed because one was stale; returns
+        True if a retry with fresh uploads is worthwhile. Other errors are left
+        to the resilience policy.
+        """
+        if not is_stale_handle_error(error):
+            return False
+        if self.image_store is None or not self.image_store.has_handles(digests):
+            return False
+        self.image_store.invalidate(digests)
+        return True
+    
+    def _lookup_cached(self, model, prompt, digests, generation_config=None):
+        """Return (cache_key, cached_text); both are None when caching is off"""
+        if self.cache is None:
+            return None, None
+        
+        key_prompt = prompt
+        if generation_config:
+            key_prompt += json.dumps(generation_config, sort_keys=True)
+        cache_key = make_cache_key(
+            getattr(model, 'model_name', type(model).__name__),
+            key_prompt,
+            digests
+        )
+        cached = self.cache.get(cache_key)
+        self.metrics.inc('cache_requests_total', result='miss' if cached is None else 'hit')
+        return cache_key, cached
+    
+    def _parse_cached(self, text, parse):
+        """Return parse(text), or None if a cached reply no longer parses and must be fetched again"""
+        if parse is None:
+            return text
+        try:
+            return parse(text)
+        except Exception:
+            return None
+    
+    def _store_cached(self, cache_key, text):
+        if cache_key is not None:
+            self.cache.set(cache_key, text)
+    
     def _prepare_image_for_gemini(self, image):
         """Convert PIL Image to format suitable for Gemini API"""
         # Convert PIL Image to bytes
-        img_byte_arr = io.BytesIO()
-        image.save(img_byte_arr, format='PNG')
-        img_byte_arr = img_byte_arr.getvalue()
+        with self.metrics.span('stage_seconds', stage='encode'):
+            max_side = self._profile().get('model_max_side')
+            if max_side and max(image.size) > max_side:
+                image = image.copy()
+                image.thumbnail((max_side, max_side), resample_filter(self._profile()))
+            img_byte_arr = io.BytesIO()
+            image.save(img_byte_arr, format='PNG')
+            img_byte_arr = img_byte_arr.getvalue()
         
         # Create the image data structure for Gemini
         return {
@@ -202,6 +947,8 @@ class DressSynthesizer:
         """
         Create an enhanced virtual try-on using AI insights about fit and style
         """
+        self._count_result('model')
+        
         # Parse AI descriptions for detailed fitting information
         fitting_info = self._parse_ai_description(visualization_desc + " " + analysis_desc)
         
@@ -216,27 +963,65 @@ class DressSynthesizer:
         """
         Create a more realistic virtual try-on based on AI analysis
         """
-        # Start with the human image as base
-        result = human_image.copy()
+        with self.metrics.span('stage_seconds', stage='composite'):
+            # Shoulder, waist and hip lines from the person's silhouette
+            body = self.landmarks.estimate(human_image)
+            
+            # Create multiple layers for realistic compositing
+            dress_layer = self._create_fitted_dress_layer(dress_image, human_image, fitting_info, body)
+            position = self._dress_position(human_image.size, dress_layer.size, fitting_info, body)
+            
+            # One output buffer for the whole frame: the dress is blended into
+            # it and the effects below only rewrite the dress region
+            result = np.array(human_image if human_image.mode == 'RGB' else human_image.convert('RGB'))
+            blend_into(result, dress_layer, position, BODY_COMPOSITE_LUT)
         
-        # Create multiple layers for realistic compositing
-        dress_layer = self._create_fitted_dress_layer(dress_image, human_image, fitting_info)
+        # Apply post-processing for realism around the dress, feathered into the frame
+        if self._profile()['enhance']:
+            with self.metrics.span('stage_seconds', stage='effects'):
+                enhance_region(result, dress_layer.size, position, self._effects_chain(ai_description))
         
-        # Apply dress to person with intelligent masking
-        composite = self._composite_dress_on_body(result, dress_layer, fitting_info)
+        return Image.fromarray(result)
+    
+    def _create_fitted_dress_layer(self, dress_image, human_image, fitting_info, body=None):
+        """
+        Create a dress layer fitted to the human body proportions
+        """
+        dress_size = self._fitted_dress_size(human_image.size, fitting_info, body)
         
-        # Apply post-processing for realism
-        final_result = self._apply_realistic_effects(composite, ai_description)
+        # Catalog dresses are resampled from the nearest pre-resampled pyramid level,
+        # unless the catalog was compiled for another quality profile
+        catalog_id = dress_image.info.get('catalog_id')
+        if self.catalog is not None and catalog_id:
+            fitted_dress = self.catalog.get_fitted(
+                catalog_id, dress_size, resample_filter(self._profile()), quality=self.quality
+            )
+            if fitted_dress is not None:
+                return fitted_dress
         
-        return final_result
+        # Resize dress to fit body
+        fitted_dress = dress_image.resize(
+            dress_size, 
+            resample_filter(self._profile())
+        )
+        
+        return fitted_dress
     
-    def _create_fitted_dress_layer(self, dress_image, human_image, fitting_info):
+    def _fitted_dress_size(self, human_size, fitting_info, body=None):
         """
-        Create a dress layer fitted to the human body proportions
+        Return the (width, height) a dress is resized to for a person of human_size.
+        body holds estimated landmarks; without them fixed proportions are used.
         """
-        # Estimate body dimensions from human image
-        body_width = int(human_image.width * 0.6)  # Approximate torso width
-        body_height = int(human_image.height * 0.7)  # Approximate torso height
+        if body is not None:
+            # Dress images have a margin around the garment, so the layer is
+            # wider than the torso; a regular dress reaches about twice the
+            # shoulder-to-hip distance below the shoulders
+            body_width = min(human_size[0], int(max(body['torso_width'], body['hip_width']) * 1.25))
+            body_height = min(human_size[1], int((body['hip_y'] - body['shoulder_y']) * 2.2))
+        else:
+            # Estimate body dimensions from human image
+            body_width = int(human_size[0] * 0.6)  # Approximate torso width
+            body_height = int(human_size[1] * 0.7)  # Approximate torso height
         
         # Adjust dress size based on fitting analysis
         if fitting_info.get('body_type') == 'slim':
@@ -254,136 +1039,95 @@ class DressSynthesizer:
         else:
             dress_height = body_height
         
-        # Resize dress to fit body
-        fitted_dress = dress_image.resize(
-            (dress_width, dress_height), 
-            Image.Resampling.LANCZOS
-        )
-        
-        return fitted_dress
+        return dress_width, dress_height
     
-    def _composite_dress_on_body(self, human_image, dress_layer, fitting_info):
+    def _composite_dress_on_body(self, human_image, dress_layer, fitting_info, body=None):
         """
-        Composite the dress onto the human body with intelligent positioning
+        Composite the dress onto the human body with intelligent positioning.
+        body holds estimated landmarks; without them fixed proportions are used.
         """
-        # Create overlay canvas
-        overlay = Image.new('RGBA', human_image.size, (0, 0, 0, 0))
-        
-        # Calculate positioning based on body landmarks (simplified)
-        center_x = human_image.width // 2
+        position = self._dress_position(human_image.size, dress_layer.size, fitting_info, body)
         
-        # Estimate where dress should sit based on analysis
-        if 'shoulders' in fitting_info.get('dress_position', '').lower():
-            start_y = int(human_image.height * 0.15)  # Shoulder level
-        elif 'chest' in fitting_info.get('dress_position', '').lower():
-            start_y = int(human_image.height * 0.25)  # Chest level
+        # Blend with variable transparency for a more realistic look
+        return composite_layer(human_image, dress_layer, position, BODY_COMPOSITE_LUT)
+    
+    def _dress_position(self, human_size, dress_size, fitting_info, body=None):
+        """Return the (x, y) the top-left corner of a fitted dress layer is placed at"""
+        human_width, human_height = human_size
+        dress_position = fitting_info.get('dress_position', '').lower()
+        if body is not None:
+            center_x = body['center_x']
+            if 'shoulders' in dress_position:
+                start_y = body['shoulder_y']
+            elif 'chest' in dress_position:
+                start_y = body['chest_y']
+            else:
+                start_y = (body['shoulder_y'] + body['chest_y']) // 2
         else:
-            start_y = int(human_image.height * 0.2)   # Default upper torso
+            # Calculate positioning based on body landmarks (simplified)
+            center_x = human_width // 2
+            
+            # Estimate where dress should sit based on analysis
+            if 'shoulders' in dress_position:
+                start_y = int(human_height * 0.15)  # Shoulder level
+            elif 'chest' in dress_position:
+                start_y = int(human_height * 0.25)  # Chest level
+            else:
+                start_y = int(human_height * 0.2)   # Default upper torso
         
         # Position dress
-        dress_x = center_x - (dress_layer.width // 2)
+        dress_x = center_x - (dress_size[0] // 2)
         dress_y = start_y
         
         # Ensure dress stays within image bounds
-        dress_x = max(0, min(dress_x, human_image.width - dress_layer.width))
-        dress_y = max(0, min(dress_y, human_image.height - dress_layer.height))
-        
-        # Convert dress to RGBA and apply blending
-        if dress_layer.mode != 'RGBA':
-            dress_layer = dress_layer.convert('RGBA')
-        
-        # Create more natural blending
-        alpha = dress_layer.split()[-1]
-        # Variable transparency for more realistic look
-        alpha = alpha.point(lambda p: int(p * 0.85) if p > 128 else int(p * 0.7))
-        dress_layer.putalpha(alpha)
-        
-        # Paste dress onto overlay
-        overlay.paste(dress_layer, (dress_x, dress_y), dress_layer)
-        
-        # Composite with human image
-        human_rgba = human_image.convert('RGBA')
-        result = Image.alpha_composite(human_rgba, overlay)
-        
-        return result.convert('RGB')
+        dress_x = max(0, min(dress_x, human_width - dress_size[0]))
+        dress_y = max(0, min(dress_y, human_height - dress_size[1]))
+        return dress_x, dress_y
     
     def _apply_realistic_effects(self, image, ai_description):
         """
-        Apply post-processing effects for more realistic appearance
+        Apply post-processing effects for more realistic appearance to a whole image
         """
-        result = image.copy()
-        
-        # Apply subtle blur to dress edges for natural integration
-        # This is a simplified approach - in production, use edge detection
-        
-        # Enhance based on AI description
-        if 'vibrant' in ai_description.lower() or 'bright' in ai_description.lower():
-            enhancer = ImageEnhance.Color(result)
-            result = enhancer.enhance(1.15)
-        
-        if 'soft' in ai_description.lower() or 'flowing' in ai_description.lower():
-            # Apply slight blur for softer look
-            result = result.filter(ImageFilter.GaussianBlur(radius=0.5))
+        return self._effects_chain(ai_description).apply(image)
+    
+    def _effects_chain(self, ai_description):
+        """Return the post-processing EnhancementChain for an AI description"""
+        description_lower = ai_description.lower()
         
-        # Enhance contrast slightly for better definition
-        enhancer = ImageEnhance.Contrast(result)
-        result = enhancer.enhance(1.05)
+        # Enhance based on AI description, applied as one fused pass:
+        # color boost for vibrant looks, slight blur for a softer look,
+        # and a slight contrast lift for better definition
+        chain = EnhancementChain(contrast=1.05)
+        if 'vibrant' in description_lower or 'bright' in description_lower:
+            chain.color = 1.15
+        if 'soft' in description_lower or 'flowing' in description_lower:
+            chain.blur_radius = 0.5
         
-        return result
+        return chain
     
     def _parse_ai_description(self, description):
-        """Extract detailed fitting information from AI description"""
-        fitting_info = {
-            'body_type': 'average',
-            'dress_fit': 'regular',
-            'dress_style': 'regular',
-            'dress_position': 'chest',
-            'color_match': 'good',
-            'style_compatibility': 'high',
-            'fabric_behavior': 'normal',
-            'suggested_adjustments': []
-        }
+        """
+        Extract detailed fitting information from AI description.
+        Accepts either free text or a structured (fused) analysis dict.
+        """
+        if isinstance(description, dict):
+            fitting_info = FittingParser().fitting_info()
+            for key, allowed in FITTING_ATTRIBUTE_VALUES.items():
+                value = str(description.get(key, '')).lower()
+                if value in allowed:
+                    fitting_info[key] = value
+            for key in ('color_match', 'style_compatibility'):
+                if description.get(key):
+                    fitting_info[key] = str(description[key])
+            fitting_info['suggested_adjustments'] = self._as_string_list(
+                description.get('suggested_adjustments')
+            )
+            return fitting_info
         
         # Comprehensive keyword analysis
-        description_lower = description.lower()
-        
-        # Body type analysis
-        if any(word in description_lower for word in ['slim', 'slender', 'thin', 'lean']):
-            fitting_info['body_type'] = 'slim'
-        elif any(word in description_lower for word in ['curvy', 'full', 'plus-size', 'voluptuous']):
-            fitting_info['body_type'] = 'curvy'
-        elif any(word in description_lower for word in ['athletic', 'muscular', 'toned']):
-            fitting_info['body_type'] = 'athletic'
-            
-        # Dress fit analysis
-        if any(word in description_lower for word in ['tight', 'fitted', 'snug', 'form-fitting']):
-            fitting_info['dress_fit'] = 'tight'
-        elif any(word in description_lower for word in ['loose', 'flowing', 'relaxed', 'baggy']):
-            fitting_info['dress_fit'] = 'loose'
-            
-        # Dress style analysis
-        if any(word in description_lower for word in ['short', 'mini', 'above knee']):
-            fitting_info['dress_style'] = 'short'
-        elif any(word in description_lower for word in ['long', 'maxi', 'floor-length', 'ankle']):
-            fitting_info['dress_style'] = 'long'
-        elif any(word in description_lower for word in ['midi', 'knee-length', 'below knee']):
-            fitting_info['dress_style'] = 'midi'
-            
-        # Position analysis
-        if any(word in description_lower for word in ['shoulder', 'neckline', 'collar']):
-            fitting_info['dress_position'] = 'shoulders'
-        elif any(word in description_lower for word in ['chest', 'bust', 'breast']):
-            fitting_info['dress_position'] = 'chest'
-        elif any(word in description_lower for word in ['waist', 'waistline', 'middle']):
-            fitting_info['dress_position'] = 'waist'
-            
-        # Fabric behavior
-        if any(word in description_lower for word in ['drape', 'flow', 'cascade', 'fall']):
-            fitting_info['fabric_behavior'] = 'flowing'
-        elif any(word in description_lower for word in ['structured', 'stiff', 'rigid']):
-            fitting_info['fabric_behavior'] = 'structured'
-            
-        return fitting_info
+        parser = FittingParser()
+        parser.feed(description)
+        return parser.fitting_info()
     
     def _process_dress_for_fitting(self, dress_image, fitting_info):
         """Process dress image for better fitting on the person"""
@@ -405,9 +1149,6 @@ class DressSynthesizer:
     
     def _create_dress_overlay(self, human_image, processed_dress, fitting_info):
         """Create positioned dress overlay on the human image"""
-        # Create transparent overlay
-        overlay = Image.new('RGBA', human_image.size, (0, 0, 0, 0))
-        
         # Calculate positioning based on human body analysis
         # This is simplified - in production, use body landmark detection
         human_center_x = human_image.width // 2
@@ -421,18 +1162,8 @@ class DressSynthesizer:
         dress_x = max(0, min(dress_x, human_image.width - processed_dress.width))
         dress_y = max(0, min(dress_y, human_image.height - processed_dress.height))
         
-        # Convert dress to RGBA for transparency
-        if processed_dress.mode != 'RGBA':
-            processed_dress = processed_dress.convert('RGBA')
-        
-        # Apply transparency for blending
-        alpha = processed_dress.split()[-1]
-        alpha = alpha.point(lambda p: p * 0.8)  # Make semi-transparent
-        processed_dress.putalpha(alpha)
-        
-        overlay.paste(processed_dress, (dress_x, dress_y), processed_dress)
-        
-        return overlay
+        # Build the semi-transparent overlay directly from array operations
+        return build_overlay(human_image.size, processed_dress, (dress_x, dress_y), DRESS_OVERLAY_LUT)
     
     def _blend_dress_on_person(self, human_image, dress_overlay, fitting_info):
         """Blend dress overlay onto human using advanced compositing"""
@@ -449,19 +1180,14 @@ class DressSynthesizer:
     
     def _apply_ai_enhancements(self, image, ai_description):
         """Apply AI-suggested visual enhancements"""
-        # Apply subtle enhancements based on AI analysis
-        enhanced = image.copy()
-        
-        # Enhance colors if AI suggests good color compatibility
-        if 'complement' in ai_description.lower() or 'match' in ai_description.lower():
-            enhancer = ImageEnhance.Color(enhanced)
-            enhanced = enhancer.enhance(1.1)  # Slight color boost
-        
-        # Add slight sharpening for better definition
-        enhancer = ImageEnhance.Sharpness(enhanced)
-        enhanced = enhancer.enhance(1.05)
+        # Apply subtle enhancements based on AI analysis: a slight color boost
+        # if AI suggests good color compatibility, plus slight sharpening
+        chain = EnhancementChain(sharpness=1.05)
+        description_lower = ai_description.lower()
+        if 'complement' in description_lower or 'match' in description_lower:
+            chain.color = 1.1
         
-        return enhanced
+        return chain.apply(image)
     
     def _create_simple_composite(self, human_image, dress_image):
         """Create a simple side-by-side composite as fallback"""
@@ -483,31 +1209,66 @@ class DressSynthesizer:
         
         return composite
     
+    def generate_try_on_batch(self, human_image, dress_images, image_processor=None, max_workers=4):
+        """
+        Try one person on many dresses, yielding (index, result_image, error)
+        as each dress finishes; error is as for generate_try_on_checked. The
+        person is preprocessed and analyzed once; each dress is preprocessed,
+        analyzed, fitted and composited in a worker.
+        """
+        if image_processor is not None:
+            human_image = image_processor.preprocess_human_image(human_image)
+        
+        use_model = self._use_model()
+        person = person_error = None
+        if use_model:
+            try:
+                person = self.analyze_person(human_image)
+            except CircuitOpenError:
+                # The API is degraded; fit every dress locally instead of waiting on it
+                use_model = False
+            except Exception as e:
+                person_error = f"Error in AI processing: {str(e)}"
+                self._report_error(person_error)
+        
+        def process(dress_image):
+            if image_processor is not None:
+                dress_image = image_processor.preprocess_dress_image(dress_image)
+            if not use_model:
+                return self._create_local_try_on(human_image, dress_image), None
+            if person is None:
+                return self._create_advanced_composite(human_image, dress_image), person_error
+            
+            try:
+                dress = self.analyze_dress(dress_image)
+            except CircuitOpenError:
+                return self._create_local_try_on(human_image, dress_image), None
+            except Exception as e:
+                error = f"Error in AI processing: {str(e)}"
+                self._report_error(error)
+                return self._create_advanced_composite(human_image, dress_image), error
+            
+            analysis = self.combine_analyses(person, dress)
+            return self._create_fused_try_on(human_image, dress_image, analysis), None
+        
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(process, dress_image): index
+                for index, dress_image in enumerate(dress_images)
+            }
+            for future in concurrent.futures.as_completed(futures):
+                result_image, error = future.result()
+                yield futures[future], result_image, error
+    
     def analyze_compatibility(self, human_image, dress_image):
         """Analyze style compatibility between person and dress"""
         try:
-            prompt = """
-            Analyze the compatibility between this person and this dress/clothing item.
-            Consider:
-            1. Color coordination
-            2. Style compatibility
-            3. Fit predictions
-            4. Overall aesthetic appeal
-            5. Suggestions for improvement
-            
-            Provide a detailed analysis with a compatibility score (1-10).
-            """
-            
-            human_data = self._prepare_image_for_gemini(human_image)
-            dress_data = self._prepare_image_for_gemini(dress_image)
-            
-            response = self.model.generate_content([
-                prompt,
-                human_data,
-                dress_data
-            ])
+            if self.analysis_mode == 'fused':
+                return self._format_compatibility(self.analyze_fused(human_image, dress_image))
             
-            return response.text
+            prompt = self._create_compatibility_prompt()
+            
+            return self._generate_text(prompt, [human_image, dress_image], 'compatibility')
             
         except Exception as e:
             return f"Analysis unavailable: {str(e)}"
@@ -515,27 +1276,195 @@ class DressSynthesizer:
     def get_styling_suggestions(self, human_image, dress_image):
         """Get AI-powered styling suggestions"""
         try:
-            prompt = """
-            Based on this person and dress combination, provide styling suggestions:
-            1. Recommended accessories
-            2. Shoe suggestions
-            3. Hair and makeup recommendations
-            4. Color coordination tips
-            5. Occasion suitability
-            
-            Be specific and practical in your suggestions.
-            """
-            
-            human_data = self._prepare_image_for_gemini(human_image)
-            dress_data = self._prepare_image_for_gemini(dress_image)
-            
-            response = self.model.generate_content([
-                prompt,
-                human_data,
-                dress_data
-            ])
+            if self.analysis_mode == 'fused':
+                return self._format_styling(self.analyze_fused(human_image, dress_image))
             
-            return response.text
+            prompt = self._create_styling_prompt()
+            
+            return self._generate_text(prompt, [human_image, dress_image], 'styling')
+            
+        except Exception as e:
+            return f"Suggestions unavailable: {str(e)}"
+    
+    async def generate_try_on_async(self, human_image, dress_image):
+        """Async variant of generate_try_on; compositing runs in a worker thread"""
+        if not self._use_model():
+            return await asyncio.to_thread(self._create_local_try_on, human_image, dress_image)
+        
+        deadline = self.resilience.new_deadline()
+        try:
+            if self.analysis_mode in ('fused', 'split'):
+                analysis = await self._structured_analysis_async(human_image, dress_image, deadline)
+                return await asyncio.to_thread(
+                    self._create_fused_try_on, human_image, dress_image, analysis
+                )
+            
+            images = [human_image, dress_image]
+            analysis_text = await self._generate_text_async(
+                self._create_analysis_prompt(), images, 'analysis', deadline
+            )
+            visualization_text = await self._generate_text_async(
+                self._create_visualization_prompt(analysis_text), images, 'visualization', deadline
+            )
+            
+            return await asyncio.to_thread(
+                self._create_ai_guided_try_on,
+                human_image, dress_image, visualization_text, analysis_text
+            )
+            
+        except CircuitOpenError:
+            return await asyncio.to_thread(self._create_local_try_on, human_image, dress_image)
+        except Exception as e:
+            self._report_error(f"Error in AI processing: {str(e)}")
+            return await asyncio.to_thread(self._create_advanced_composite, human_image, dress_image)
+    
+    async def analyze_compatibility_async(self, human_image, dress_image):
+        """Async variant of analyze_compatibility"""
+        try:
+            if self.analysis_mode == 'fused':
+                analysis = await self.analyze_fused_async(human_image, dress_image)
+                return self._format_compatibility(analysis)
+            
+            prompt = self._create_compatibility_prompt()
+            
+            return await self._generate_text_async(prompt, [human_image, dress_image], 'compatibility')
+            
+        except Exception as e:
+            return f"Analysis unavailable: {str(e)}"
+    
+    async def get_styling_suggestions_async(self, human_image, dress_image):
+        """Async variant of get_styling_suggestions"""
+        try:
+            if self.analysis_mode == 'fused':
+                analysis = await self.analyze_fused_async(human_image, dress_image)
+                return self._format_styling(analysis)
+            
+            prompt = self._create_styling_prompt()
+            
+            return await self._generate_text_async(prompt, [human_image, dress_image], 'styling')
+            
+        except Exception as e:
+            return f"Suggestions unavailable: {str(e)}"
+    
+    async def generate_full_result_async(self, human_image, dress_image, include_analysis=True):
+        """
+        Run the try-on, compatibility analysis and styling suggestions concurrently.
+        Returns (result_image, analysis, suggestions); the text parts are None when
+        include_analysis is False.
+        """
+        # Analysis needs the model, which the Fast profile skips
+        include_analysis = include_analysis and self._use_model()
+        
+        tasks = [self.generate_try_on_async(human_image, dress_image)]
+        if include_analysis:
+            tasks.append(self.analyze_compatibility_async(human_image, dress_image))
+            tasks.append(self.get_styling_suggestions_async(human_image, dress_image))
+        
+        results = await asyncio.gather(*tasks)
+        if not include_analysis:
+            results += [None, None]
+        
+        return tuple(results)
+    
+    async def generate_try_on_stream_async(self, human_image, dress_image):
+        """
+        Streaming variant of generate_try_on. Async generator of (event, payload):
+        - ('analysis', text) and ('visualization', text) as response text arrives
+        - ('preview', image) composited as soon as the fitting attributes settle,
+          or when the analysis finishes, while the visualization still streams
+        - ('error', message) if the AI processing failed
+        - ('result', image) exactly once, last
+        """
+        if not self._use_model():
+            yield 'result', await asyncio.to_thread(self._create_local_try_on, human_image, dress_image)
+            return
+        
+        deadline = self.resilience.new_deadline()
+        try:
+            if self.analysis_mode in ('fused', 'split'):
+                # Structured JSON is only useful once complete, so nothing streams
+                analysis = await self._structured_analysis_async(human_image, dress_image, deadline)
+                result = await asyncio.to_thread(
+                    self._create_fused_try_on, human_image, dress_image, analysis
+                )
+                yield 'result', result
+                return
+            
+            images = [human_image, dress_image]
+            parser = FittingParser()
+            analysis_parts = []
+            preview_sent = False
+            
+            analysis_prompt = self._create_analysis_prompt()
+            async for chunk in self._stream_text_async(analysis_prompt, images, 'analysis', deadline):
+                analysis_parts.append(chunk)
+                parser.feed(chunk)
+                yield 'analysis', chunk
+                
+                if not preview_sent and parser.settled:
+                    preview_sent = True
+                    yield 'preview', await asyncio.to_thread(
+                        self._create_realistic_try_on,
+                        human_image, dress_image, parser.fitting_info(), ''.join(analysis_parts)
+                    )
+            
+            analysis_text = ''.join(analysis_parts)
+            if not preview_sent:
+                yield 'preview', await asyncio.to_thread(
+                    self._create_realistic_try_on,
+                    human_image, dress_image, parser.fitting_info(), analysis_text
+                )
+            
+            visualization_parts = []
+            visualization_prompt = self._create_visualization_prompt(analysis_text)
+            stream = self._stream_text_async(visualization_prompt, images, 'visualization', deadline)
+            async for chunk in stream:
+                visualization_parts.append(chunk)
+                yield 'visualization', chunk
+            
+            result = await asyncio.to_thread(
+                self._create_ai_guided_try_on,
+                human_image, dress_image, ''.join(visualization_parts), analysis_text
+            )
+            
+        except CircuitOpenError:
+            result = await asyncio.to_thread(self._create_local_try_on, human_image, dress_image)
+        except Exception as e:
+            error = f"Error in AI processing: {str(e)}"
+            self._report_error(error)
+            yield 'error', error
+            result = await asyncio.to_thread(self._create_advanced_composite, human_image, dress_image)
+        
+        yield 'result', result
+    
+    async def stream_compatibility_async(self, human_image, dress_image):
+        """Streaming variant of analyze_compatibility; yields Markdown text chunks"""
+        try:
+            if self.analysis_mode == 'fused':
+                analysis = await self.analyze_fused_async(human_image, dress_image)
+                yield self._format_compatibility(analysis)
+                return
+            
+            prompt = self._create_compatibility_prompt()
+            images = [human_image, dress_image]
+            async for chunk in self._stream_text_async(prompt, images, 'compatibility'):
+                yield chunk
+            
+        except Exception as e:
+            yield f"Analysis unavailable: {str(e)}"
+    
+    async def stream_styling_suggestions_async(self, human_image, dress_image):
+        """Streaming variant of get_styling_suggestions; yields Markdown text chunks"""
+        try:
+            if self.analysis_mode == 'fused':
+                analysis = await self.analyze_fused_async(human_image, dress_image)
+                yield self._format_styling(analysis)
+                return
+            
+            prompt = self._create_styling_prompt()
+            images = [human_image, dress_image]
+            async for chunk in self._stream_text_async(prompt, images, 'styling'):
+                yield chunk
             
         except Exception as e:
-            return f"Suggestions unavailable: {str(e)}"
\ No newline at end of file
+            yield f"Suggestions unavailable: {str(e)}"
@@ -0,0 +1,161 @@
+import math
+
+from PIL import Image, ImageFilter
+import numpy as np
+
+# ITU-R 601-2 luma weights, as used by PIL's "L" conversion
+LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+# Rows processed per band; bounds the float working set to a few MB at print sizes
+BAND_ROWS = 256
+
+
+class EnhancementChain:
+    """
+    A chain of contrast, sharpness, colour and blur adjustments applied in a
+    single vectorized pass. Each factor has the same meaning as the matching
+    PIL.ImageEnhance class (1.0 leaves the image unchanged). Because every
+    adjustment is linear, the fused result matches running the ImageEnhance
+    chain in sequence up to per-step rounding.
+    
+    Images are processed in bands of band_rows rows, each with enough
+    neighbouring rows for the blur and sharpen filters, so the result is the
+    same as a whole-image pass while the working memory stays bounded.
+    """
+
+    def __init__(self, contrast=1.0, sharpness=1.0, color=1.0, blur_radius=0.0, band_rows=BAND_ROWS):
+        self.contrast = contrast
+        self.sharpness = sharpness
+        self.color = color
+        self.blur_radius = blur_radius
+        self.band_rows = band_rows
+
+    def is_identity(self):
+        return (self.contrast == 1.0 and self.sharpness == 1.0 and
+                self.color == 1.0 and not self.blur_radius)
+
+    def halo(self):
+        """Rows of context a band needs on each side to match a whole-image pass"""
+        rows = 1 if self.sharpness != 1.0 else 0
+        if self.blur_radius:
+            rows += 3 * math.ceil(self.blur_radius) + 2
+        return rows
+
+    def apply(self, image):
+        """Apply the whole chain to a PIL image and return a new RGB image"""
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        if self.is_identity():
+            return image.copy()
+
+        pixels = np.array(image)
+        for start, stop, enhanced in self.iter_bands(pixels):
+            pixels[start:stop] = enhanced
+        return Image.fromarray(pixels)
+
+    def apply_array(self, pixels, mean=None):
+        """
+        Apply the whole chain to a uint8 (H, W, 3) array in one pass and return
+        a new one. mean overrides the grey level contrast blends towards.
+        """
+        if self.contrast != 1.0 and mean is None:
+            mean = contrast_mean(pixels)
+        if self.blur_radius:
+            # Gaussian blur stays in PIL's C implementation; it commutes with the rest
+            pixels = np.asarray(Image.fromarray(pixels).filter(ImageFilter.GaussianBlur(radius=self.blur_radius)))
+
+        planes = np.ascontiguousarray(pixels.transpose(2, 0, 1), dtype=np.float32)
+        return self.apply_planes(planes, mean).transpose(1, 2, 0)
+
+    def iter_bands(self, pixels, band_rows=None):
+        """
+        Yield (start, stop, enhanced) for consecutive row bands of a uint8
+        (H, W, 3) array, where enhanced is the chain's output for rows
+        start:stop. Callers may write each band back into pixels as it is
+        yielded; the rows the next band needs are saved beforehand.
+        """
+        height = pixels.shape[0]
+        halo = self.halo()
+        band_rows = max(band_rows or self.band_rows or height, halo, 1)
+        mean = contrast_mean(pixels) if self.contrast != 1.0 else None
+
+        above = None  # Original rows just above the current band
+        for start in range(0, height, band_rows):
+            stop = min(start + band_rows, height)
+            bottom = min(height, stop + halo)
+            if above is not None:
+                block = np.concatenate([above, pixels[start:bottom]])
+            else:
+                block = pixels[start:bottom]
+            top = start - (len(above) if above is not None else 0)
+            above = pixels[max(0, stop - halo):stop].copy() if halo else None
+
+            enhanced = self.apply_array(block, mean)
+            yield start, stop, enhanced[start - top:stop - top]
+
+    def apply_planes(self, planes, mean=None):
+        """
+        Apply contrast, sharpness and colour to float32 (3, H, W) colour planes
+        in place, using two (H, W) scratch buffers. Returns uint8 planes.
+        mean is the grey level contrast blends towards; by default the planes' own.
+        """
+        height, width = planes.shape[1:]
+        flat = planes.reshape(3, -1)
+        scratch = np.empty(height * width, dtype=np.float32)
+        sharpen = self.sharpness != 1.0 and height > 2 and width > 2
+        if sharpen:
+            rows = np.empty((height - 2, width), dtype=np.float32)
+
+        if self.contrast != 1.0 and mean is None:
+            # ImageEnhance.Contrast blends towards the rounded mean grey level
+            np.matmul(LUMA_WEIGHTS, flat, out=scratch)
+            mean = int(float(scratch.mean(dtype=np.float64)) + 0.5)
+
+        for index in range(3):
+            if sharpen:
+                # ImageEnhance.Sharpness blends away from ImageFilter.SMOOTH
+                _sharpen_plane(planes[index], self.sharpness, rows,
+                               scratch[:(height - 2) * (width - 2)].reshape(height - 2, width - 2))
+            if self.contrast != 1.0:
+                plane = flat[index]
+                plane *= self.contrast
+                plane += (1.0 - self.contrast) * mean
+
+        if self.color != 1.0:
+            # ImageEnhance.Color blends away from the greyscale image
+            np.matmul(LUMA_WEIGHTS, flat, out=scratch)
+            scratch *= 1.0 - self.color
+            for index in range(3):
+                flat[index] *= self.color
+                flat[index] += scratch
+
+        # ImageEnhance truncates rather than rounds
+        np.clip(planes, 0, 255, out=planes)
+        return planes.astype(np.uint8)
+
+
+def contrast_mean(pixels, band_rows=BAND_ROWS):
+    """Return the rounded mean grey level of a uint8 (H, W, 3) array, summed band by band"""
+    total = 0.0
+    for start in range(0, pixels.shape[0], band_rows):
+        band = pixels[start:start + band_rows].reshape(-1, 3).astype(np.float32)
+        total += float((band @ LUMA_WEIGHTS).sum(dtype=np.float64))
+    return int(total / max(1, pixels.shape[0] * pixels.shape[1]) + 0.5)
+
+
+def _sharpen_plane(plane, factor, rows, smooth):
+    """
+    Blend one colour plane away from its 3x3 SMOOTH filter (centre weight 5,
+    divisor 13). Edge pixels are left alone, as PIL does. rows and smooth are
+    caller-owned (H-2, W) and (H-2, W-2) scratch buffers.
+    """
+    np.add(plane[:-2], plane[1:-1], out=rows)
+    rows += plane[2:]
+    np.add(rows[:, :-2], rows[:, 1:-1], out=smooth)
+    smooth += rows[:, 2:]
+
+    interior = plane[1:-1, 1:-1]
+    # smooth = (box_sum + 4 * centre) / 13, folded into the blend weights
+    smooth *= (1.0 - factor) / 13.0
+    interior *= factor + 4.0 * (1.0 - factor) / 13.0
+    interior += smooth
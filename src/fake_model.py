@@ -0,0 +1,92 @@
+"""
+Deterministic stand-in for a Gemini GenerativeModel, for benchmarks and
+offline runs. It answers every prompt with canned text after a configurable
+latency, without network access or an API key.
+"""
+
+import asyncio
+import hashlib
+import json
+import time
+import types
+
+FAKE_ANALYSIS_TEXT = (
+    "The person has a slim, balanced figure standing in a frontal pose. "
+    "The dress is a long, fitted silhouette with a defined waist and a soft fabric "
+    "that will drape and flow from the waistline. The vibrant color complements "
+    "the skin tone; the neckline should sit at the shoulders."
+)
+
+FAKE_FUSED_ANALYSIS = {
+    "body_type": "slim",
+    "dress_fit": "tight",
+    "dress_style": "long",
+    "dress_position": "shoulders",
+    "fabric_behavior": "flowing",
+    "color_match": "complements the skin tone",
+    "style_compatibility": "high",
+    "suggested_adjustments": ["Take in the waist slightly"],
+    "compatibility_score": 8,
+    "compatibility_analysis": "The colors coordinate well and the cut suits the figure.",
+    "styling_suggestions": {
+        "accessories": ["Delicate gold necklace"],
+        "shoes": ["Strappy heels"],
+        "hair_and_makeup": ["Loose waves"],
+        "color_tips": ["Keep accessories neutral"],
+        "occasions": ["Evening events"],
+    },
+    "visual_description": "The person wears a long, flowing dress that drapes softly from the shoulders.",
+}
+
+
+class FakeModel:
+    """
+    Offline GenerativeModel stub. latency is the seconds each call takes
+    (per chunk when streaming: latency / chunks). Responses depend only on
+    the prompt, so results are reproducible across runs.
+    """
+
+    def __init__(self, latency=0.0, chunks=4, model_name='fake-model'):
+        self.latency = latency
+        self.chunks = chunks
+        self.model_name = model_name
+        self.calls = 0
+
+    def generate_content(self, contents, generation_config=None, request_options=None, stream=False):
+        self.calls += 1
+        text = self._respond(contents, generation_config)
+        if stream:
+            return self._stream(text)
+        time.sleep(self.latency)
+        return types.SimpleNamespace(text=text)
+
+    async def generate_content_async(self, contents, generation_config=None,
+                                     request_options=None, stream=False):
+        self.calls += 1
+        text = self._respond(contents, generation_config)
+        if stream:
+            return self._stream_async(text)
+        await asyncio.sleep(self.latency)
+        return types.SimpleNamespace(text=text)
+
+    def _respond(self, contents, generation_config):
+        prompt = contents[0] if isinstance(contents, (list, tuple)) else contents
+        if (generation_config or {}).get('response_mime_type') == 'application/json':
+            return json.dumps(FAKE_FUSED_ANALYSIS)
+        # Vary a trailing reference with the prompt so distinct calls differ, deterministically
+        tag = hashlib.sha256(str(prompt).encode('utf-8')).hexdigest()[:8]
+        return f"{FAKE_ANALYSIS_TEXT} (ref {tag})"
+
+    def _split(self, text):
+        size = max(1, -(-len(text) // self.chunks))
+        return [text[i:i + size] for i in range(0, len(text), size)]
+
+    def _stream(self, text):
+        for part in self._split(text):
+            time.sleep(self.latency / self.chunks)
+            yield types.SimpleNamespace(text=part)
+
+    async def _stream_async(self, text):
+        for part in self._split(text):
+            await asyncio.sleep(self.latency / self.chunks)
+            yield types.SimpleNamespace(text=part)
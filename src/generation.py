@@ -0,0 +1,84 @@
+"""
+Generation settings for each kind of model call.
+
+Output length dominates model latency, so every call site gets its own token
+ceiling and temperature instead of the SDK's unbounded defaults:
+
+- analysis: fitting analysis that is only keyword-scanned
+- visualization: short description that guides the composite
+- compatibility: the user-facing style analysis
+- styling: the user-facing styling tips
+- fused: the single structured JSON call used by the 'fused' analysis mode
+- person, dress: the per-image JSON calls used by the 'split' analysis mode
+
+A profile's 'model' is None to use the synthesizer's model, or a model name
+(or model object) to route that call type elsewhere, e.g. a faster model for
+the keyword-scanned calls.
+"""
+
+# Sampling settings shared by every call type
+BASE_GENERATION_CONFIG = {
+    "top_p": 0.8,
+    "top_k": 40,
+}
+
+GENERATION_PROFILES = {
+    'analysis': {
+        'max_output_tokens': 400,
+        'temperature': 0.2,
+        'model': None,
+    },
+    'visualization': {
+        'max_output_tokens': 200,
+        'temperature': 0.4,
+        'model': None,
+    },
+    'compatibility': {
+        'max_output_tokens': 500,
+        'temperature': 0.5,
+        'model': None,
+    },
+    'styling': {
+        'max_output_tokens': 500,
+        'temperature': 0.7,
+        'model': None,
+    },
+    'fused': {
+        'max_output_tokens': 900,
+        'temperature': 0.2,
+        'model': None,
+        'response_mime_type': 'application/json',
+    },
+    'person': {
+        'max_output_tokens': 150,
+        'temperature': 0.2,
+        'model': None,
+        'response_mime_type': 'application/json',
+    },
+    'dress': {
+        'max_output_tokens': 250,
+        'temperature': 0.2,
+        'model': None,
+        'response_mime_type': 'application/json',
+    },
+}
+
+
+def build_generation_profiles(overrides=None):
+    """
+    Return a copy of GENERATION_PROFILES with overrides applied, e.g.
+    {'styling': {'max_output_tokens': 300, 'model': 'gemini-1.5-flash-8b'}}
+    """
+    profiles = {call_type: dict(profile) for call_type, profile in GENERATION_PROFILES.items()}
+    for call_type, settings in (overrides or {}).items():
+        if call_type not in profiles:
+            raise ValueError(f"Unknown generation profile: {call_type}")
+        profiles[call_type].update(settings)
+    return profiles
+
+
+def generation_config_for(profile):
+    """Build the generation_config dict passed to generate_content for a profile"""
+    config = dict(BASE_GENERATION_CONFIG)
+    config.update({key: value for key, value in profile.items() if key != 'model'})
+    return config
@@ -0,0 +1,122 @@
+import io
+import threading
+import time
+from collections import OrderedDict
+
+# google.api_core exception names raised when a referenced file is gone or not ours
+STALE_HANDLE_ERROR_NAMES = {'NotFound', 'PermissionDenied'}
+# Raised for malformed requests in general; only stale when the message is about a file
+FILE_ARGUMENT_ERROR_NAMES = {'InvalidArgument', 'BadRequest'}
+
+
+def is_stale_handle_error(error):
+    """Return True for errors that mean an uploaded file handle is expired or missing"""
+    name = type(error).__name__
+    if name in STALE_HANDLE_ERROR_NAMES:
+        return True
+    return name in FILE_ARGUMENT_ERROR_NAMES and 'file' in str(error).lower()
+
+
+class ImageHandleStore:
+    """
+    Encodes each distinct image once and uploads it once, so repeated model
+    calls reference a file handle instead of re-sending inline PNG bytes.
+    Entries are keyed by image content hash and re-uploaded when they expire.
+    """
+
+    def __init__(self, uploader=None, ttl_seconds=46 * 3600, max_entries=128, clock=time.time):
+        # uploader(file_obj, mime_type) -> handle usable as a generate_content part.
+        # Without one, images are sent inline but still encoded only once.
+        self.uploader = uploader
+        self.ttl_seconds = ttl_seconds  # Gemini keeps uploaded files for 48 hours
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self.uploads = 0
+        self.reuses = 0
+
+    def get_part(self, digest, image, encoder):
+        """
+        Return a content part for image. encoder(image) must return an inline
+        {"mime_type", "data"} dict; it only runs the first time a digest is seen.
+        """
+        entry = self._get_entry(digest)
+        if entry is not None and self._is_fresh(entry):
+            self.reuses += 1
+            return entry['handle'] or entry['inline']
+
+        with self._lock_for(digest):
+            # Another thread may have finished the upload while we waited
+            entry = self._get_entry(digest)
+            if entry is not None and self._is_fresh(entry):
+                self.reuses += 1
+                return entry['handle'] or entry['inline']
+
+            inline = entry['inline'] if entry is not None else encoder(image)
+            handle = None
+            if self.uploader is not None:
+                try:
+                    handle = self.uploader(io.BytesIO(inline['data']), inline['mime_type'])
+                    self.uploads += 1
+                except Exception:
+                    # Uploading is an optimization; inline bytes always work
+                    handle = None
+
+            self._put_entry(digest, {
+                'inline': inline,
+                'handle': handle,
+                'expires_at': self.clock() + self.ttl_seconds,
+            })
+            return handle or inline
+
+    def invalidate(self, digests):
+        """Forget the uploaded handles for digests so the next call re-uploads them"""
+        with self._lock:
+            for digest in digests:
+                entry = self._entries.get(digest)
+                if entry is not None:
+                    entry['handle'] = None
+                    entry['expires_at'] = 0
+
+    def has_handles(self, digests):
+        """Return True if any of digests is currently served by an uploaded handle"""
+        with self._lock:
+            return any(
+                self._entries.get(digest, {}).get('handle') is not None for digest in digests
+            )
+
+    def _is_fresh(self, entry):
+        # Inline-only entries never expire; uploaded handles (or failed uploads) do
+        return self.uploader is None or self.clock() < entry['expires_at']
+
+    def _get_entry(self, digest):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                self._entries.move_to_end(digest)
+            return entry
+
+    def _put_entry(self, digest, entry):
+        with self._lock:
+            self._entries[digest] = entry
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                old_digest, _ = self._entries.popitem(last=False)
+                self._key_locks.pop(old_digest, None)
+
+    def _lock_for(self, digest):
+        with self._lock:
+            lock = self._key_locks.get(digest)
+            if lock is None:
+                lock = threading.Lock()
+                self._key_locks[digest] = lock
+            return lock
+
+
+def gemini_uploader(file_obj, mime_type):
+    """Upload image bytes through the Gemini File API"""
+    import google.generativeai as genai
+
+    return genai.upload_file(file_obj, mime_type=mime_type)
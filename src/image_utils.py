@@ -1,13 +1,26 @@
-from PIL import Image, ImageOps, ImageEnhance
-import numpy as np
+from PIL import Image, ImageOps
+from .enhance import EnhancementChain
+from .quality import DEFAULT_QUALITY, get_quality_profile, resample_filter
+from .metrics import METRICS
 # import cv2  # Removed to avoid conflicts with opencv-python-headless
 
 class ImageProcessor:
     """Handles image preprocessing for the virtual try-on application"""
     
-    def __init__(self):
-        self.target_size = (512, 768)  # Width x Height for consistent processing
+    def __init__(self, quality=DEFAULT_QUALITY, metrics=None):
         self.max_file_size = 10 * 1024 * 1024  # 10MB limit
+        self.metrics = metrics or METRICS  # Timing spans, see metrics.py
+        self.enhancement = EnhancementChain(contrast=1.1, sharpness=1.1, color=1.05)
+        self.set_quality(quality)
+    
+    def set_quality(self, quality):
+        """Apply an "Output Quality" processing profile (Fast, Balanced, High Quality)"""
+        profile = get_quality_profile(quality)
+        self.quality = quality
+        self.target_size = profile['target_size']  # Width x Height for consistent processing
+        self.dress_box = profile['dress_box']  # Bounding box for preprocessed dress images
+        self.resample = resample_filter(profile)
+        self.enhance = profile['enhance']
     
     def preprocess_human_image(self, image):
         """
@@ -16,25 +29,19 @@ class ImageProcessor:
         - Enhance quality
         - Ensure proper orientation
         """
+        with self.metrics.span('stage_seconds', stage='preprocess_human'):
+            return self._preprocess_human_image(image)
+    
+    def _preprocess_human_image(self, image):
         # Convert to RGB if needed
         if image.mode != 'RGB':
             image = image.convert('RGB')
         
-        # Get original dimensions
-        original_width, original_height = image.size
-        
         # Calculate new dimensions maintaining aspect ratio
-        if original_height > original_width:
-            # Portrait orientation (preferred)
-            new_height = self.target_size[1]
-            new_width = int((original_width / original_height) * new_height)
-        else:
-            # Landscape orientation - adjust accordingly
-            new_width = self.target_size[0]
-            new_height = int((original_height / original_width) * new_width)
+        new_width, new_height = self._human_resize_size(image.size)
         
         # Resize image
-        image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        image = image.resize((new_width, new_height), self.resample)
         
         # Create a canvas with target size and paste the image centered
         canvas = Image.new('RGB', self.target_size, (255, 255, 255))
@@ -47,6 +54,27 @@ class ImageProcessor:
         
         return canvas
     
+    def _human_resize_size(self, size):
+        """Return the size a human photo of the given size is resized to"""
+        original_width, original_height = size
+        
+        if original_height > original_width:
+            # Portrait orientation (preferred)
+            new_height = self.target_size[1]
+            new_width = int((original_width / original_height) * new_height)
+        else:
+            # Landscape orientation - adjust accordingly
+            new_width = self.target_size[0]
+            new_height = int((original_height / original_width) * new_width)
+        
+        return new_width, new_height
+    
+    def _dress_resize_size(self, size):
+        """Return the size a dress image of the given size is thumbnailed to"""
+        width, height = size
+        scale = min(self.dress_box[0] / width, self.dress_box[1] / height, 1.0)
+        return max(1, int(width * scale)), max(1, int(height * scale))
+    
     def preprocess_dress_image(self, image):
         """
         Preprocess dress image for virtual try-on
@@ -54,12 +82,19 @@ class ImageProcessor:
         - Remove background if possible
         - Enhance details
         """
-        # Convert to RGB if needed
+        with self.metrics.span('stage_seconds', stage='preprocess_dress'):
+            return self._preprocess_dress_image(image)
+    
+    def _preprocess_dress_image(self, image):
+        # Convert to RGB if needed; either way work on a copy, since
+        # thumbnail() resizes in place and callers may keep the original
         if image.mode != 'RGB':
             image = image.convert('RGB')
+        else:
+            image = image.copy()
         
         # Resize maintaining aspect ratio
-        image.thumbnail((400, 600), Image.Resampling.LANCZOS)
+        image.thumbnail(self.dress_box, self.resample)
         
         # Enhance image quality
         image = self._enhance_image(image)
@@ -68,36 +103,86 @@ class ImageProcessor:
     
     def _enhance_image(self, image):
         """Enhance image quality with brightness, contrast, and sharpness adjustments"""
-        # Enhance contrast slightly
-        enhancer = ImageEnhance.Contrast(image)
-        image = enhancer.enhance(1.1)
-        
-        # Enhance sharpness
-        enhancer = ImageEnhance.Sharpness(image)
-        image = enhancer.enhance(1.1)
-        
-        # Enhance color saturation slightly
-        enhancer = ImageEnhance.Color(image)
-        image = enhancer.enhance(1.05)
+        if not self.enhance:
+            return image
         
-        return image
+        # Contrast 1.1, sharpness 1.1 and color 1.05, fused into a single pass
+        return self.enhancement.apply(image)
     
     def validate_image(self, image_file):
         """Validate uploaded image file"""
+        image, message = self.load_image(image_file)
+        if image is None:
+            return False, message
+        return True, "Valid image"
+    
+    def load_image(self, image_file, purpose='human'):
+        """
+        Validate and decode an uploaded image at reduced scale.
+        - JPEGs are decoded with draft mode close to the size preprocessing needs
+        - Other formats are box-reduced by an integer factor right after decoding
+        - EXIF orientation is applied
+        Returns (image, message); image is None if the file is invalid.
+        The full-resolution size is kept in image.info['original_size'].
+        """
         if image_file is None:
-            return False, "No image file provided"
+            return None, "No image file provided"
         
+        with self.metrics.span('stage_seconds', stage='decode'):
+            return self._load_image(image_file, purpose)
+    
+    def _load_image(self, image_file, purpose):
         # Check file size
         if hasattr(image_file, 'size') and image_file.size > self.max_file_size:
-            return False, f"File size too large. Maximum allowed: {self.max_file_size // (1024*1024)}MB"
+            return None, f"File size too large. Maximum allowed: {self.max_file_size // (1024*1024)}MB"
         
         try:
-            # Try to open and verify the image
+            if hasattr(image_file, 'seek'):
+                image_file.seek(0)
             image = Image.open(image_file)
-            image.verify()  # Verify it's a valid image
-            return True, "Valid image"
+            
+            # Work out the size we need in the final (EXIF-rotated) orientation
+            orientation = image.getexif().get(0x0112, 1)
+            rotated = orientation in (5, 6, 7, 8)
+            width, height = image.size
+            original_size = (height, width) if rotated else (width, height)
+            
+            if purpose == 'dress':
+                needed = self._dress_resize_size(original_size)
+            else:
+                needed = self._human_resize_size(original_size)
+            if rotated:
+                needed = (needed[1], needed[0])
+            
+            # JPEG decoders can scale by 1/2, 1/4 or 1/8 while decoding
+            image.draft('RGB', needed)
+            # Loading decodes the pixels and raises on truncated or corrupt data
+            image.load()
+            
+            # Keep at least twice the needed size so the final LANCZOS resize still has detail
+            factor = min(image.width // max(needed[0], 1), image.height // max(needed[1], 1)) // 2
+            if factor >= 2:
+                image = self._reducible(image).reduce(factor)
+            
+            image = ImageOps.exif_transpose(image)
+            image.info['original_size'] = original_size
+            return image, "Valid image"
         except Exception as e:
-            return False, f"Invalid image file: {str(e)}"
+            return None, f"Invalid image file: {str(e)}"
+    
+    def _reducible(self, image):
+        """
+        Convert modes Image.reduce cannot average (palette, 1-bit, 16-bit) to
+        the nearest mode it can; other images are returned unchanged.
+        """
+        if image.mode in ('P', 'PA'):
+            # Same colours preprocessing gets from an unreduced palette image
+            return image.convert('RGBA' if image.mode == 'PA' else 'RGB')
+        if image.mode == '1':
+            return image.convert('L')
+        if image.mode.startswith('I;16'):
+            return image.convert('I')
+        return image
     
     def create_side_by_side_comparison(self, original, result):
         """Create a side-by-side comparison image"""
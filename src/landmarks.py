@@ -0,0 +1,205 @@
+"""
+Local body landmark estimation for dress placement.
+
+Segments the person from the background on a small thumbnail and reads the
+shoulder, chest, waist and hip lines and the torso width off the silhouette's
+row widths. It runs on the CPU in a few milliseconds, so placement does not
+wait on the model. OpenCV, when installed, cleans up the silhouette mask;
+NumPy alone is enough otherwise.
+"""
+
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+import numpy as np
+
+from .cache import image_digest
+from .metrics import METRICS
+
+# Width of the thumbnail the silhouette is estimated on
+ANALYSIS_WIDTH = 96
+# Summed RGB distance from the background colour that counts as foreground
+FOREGROUND_THRESHOLD = 60
+# Canvas padding added by ImageProcessor.preprocess_human_image is pure white
+CANVAS_LEVEL = 250
+
+_cv2 = None
+
+
+def _load_cv2():
+    """Return the cv2 module, or False if OpenCV is not installed; imported on first use"""
+    global _cv2
+    if _cv2 is None:
+        try:
+            import cv2
+            _cv2 = cv2
+        except ImportError:
+            _cv2 = False
+    return _cv2
+
+
+def _content_box(pixels):
+    """Return (top, bottom, left, right) of the photo inside its white canvas padding"""
+    content = (pixels < CANVAS_LEVEL).any(axis=2)
+    rows = np.flatnonzero(content.any(axis=1))
+    cols = np.flatnonzero(content.any(axis=0))
+    if rows.size == 0 or cols.size == 0:
+        return None
+    return rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+
+
+def _shifted(mask, combine):
+    """Combine each pixel of a boolean mask with its 3x3 neighbourhood"""
+    padded = np.pad(mask, 1, mode='edge')
+    height, width = mask.shape
+    result = mask.copy()
+    for dy in range(3):
+        for dx in range(3):
+            result = combine(result, padded[dy:dy + height, dx:dx + width])
+    return result
+
+
+def _open_mask(mask):
+    """Morphological opening: removes specks and one-pixel seams"""
+    return _shifted(_shifted(mask, np.logical_and), np.logical_or)
+
+
+def _foreground_mask(pixels):
+    """Mark pixels that differ from the background, estimated from the photo's top and side edges"""
+    edge = max(1, pixels.shape[1] // 24)
+    border = np.concatenate([
+        pixels[:edge].reshape(-1, 3),
+        pixels[:, :edge].reshape(-1, 3),
+        pixels[:, -edge:].reshape(-1, 3),
+    ])
+    background = np.median(border, axis=0)
+    mask = np.abs(pixels.astype(np.int16) - background.astype(np.int16)).sum(axis=2) > FOREGROUND_THRESHOLD
+
+    cv2 = _load_cv2()
+    if cv2:
+        # Close small holes, drop speckle and keep the largest connected blob
+        kernel = np.ones((3, 3), np.uint8)
+        mask = cv2.morphologyEx(mask.astype(np.uint8), cv2.MORPH_CLOSE, kernel)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        if count > 1:
+            largest = 1 + int(np.argmax(stats[1:, cv2.CC_STAT_AREA]))
+            return labels == largest
+        return mask.astype(bool)
+    return _open_mask(mask)
+
+
+def _smooth(values, window=5):
+    kernel = np.ones(window) / window
+    return np.convolve(np.pad(values, window // 2, mode='edge'), kernel, mode='valid')
+
+
+def estimate_landmarks(image):
+    """
+    Estimate body landmarks for a person photo.
+    Returns a dict of pixel coordinates in the image (shoulder_y, chest_y,
+    waist_y, hip_y, center_x, torso_width, hip_width), or None if no
+    plausible silhouette was found.
+    """
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    scale = image.width / ANALYSIS_WIDTH
+    thumbnail = image.resize(
+        (ANALYSIS_WIDTH, max(1, round(image.height / scale))), Image.BILINEAR
+    )
+    pixels = np.asarray(thumbnail)
+
+    box = _content_box(pixels)
+    if box is None:
+        return None
+    top, bottom, left, right = box
+    if bottom - top < 16 or right - left < 8:
+        return None
+    mask = _foreground_mask(pixels[top:bottom, left:right])
+
+    # Ignore a person filling almost nothing or almost everything: the background guess failed
+    coverage = mask.mean()
+    if coverage < 0.03 or coverage > 0.85:
+        return None
+
+    filled = mask.any(axis=1)
+    row_left = mask.argmax(axis=1)
+    row_right = mask.shape[1] - 1 - mask[:, ::-1].argmax(axis=1)
+    widths = np.where(filled, row_right - row_left + 1, 0).astype(np.float64)
+    rows = np.flatnonzero(widths >= 2)
+    if rows.size == 0:
+        return None
+    head, foot = rows[0], rows[-1]
+    height = foot - head
+    if height < 0.3 * mask.shape[0]:
+        return None
+    widths = _smooth(widths)
+
+    def window(start, end):
+        return int(head + start * height), max(int(head + start * height) + 1, int(head + end * height))
+
+    # Neck is the narrowest row below the head; shoulders are where the width
+    # first reaches most of its upper-body maximum below the neck
+    start, end = window(0.08, 0.22)
+    neck = start + int(np.argmin(widths[start:end]))
+    end = window(0.0, 0.32)[1]
+    upper = widths[neck:end]
+    if upper.size == 0:
+        return None
+    shoulder = neck + int(np.argmax(upper >= 0.9 * upper.max()))
+    start, end = window(0.35, 0.55)
+    start = max(start, shoulder + 1)
+    if start >= end:
+        return None
+    waist = start + int(np.argmin(widths[start:end]))
+    end = max(waist + 1, window(0.0, 0.62)[1])
+    hip = waist + int(np.argmax(widths[waist:end]))
+
+    torso = slice(shoulder, waist + 1)
+    centers = (row_left[torso] + row_right[torso]) / 2.0
+    center = float(np.median(centers[filled[torso]])) if filled[torso].any() else mask.shape[1] / 2.0
+
+    def to_y(row):
+        return int(round((top + row) * scale))
+
+    return {
+        'shoulder_y': to_y(shoulder),
+        'chest_y': to_y(shoulder + (waist - shoulder) / 3),
+        'waist_y': to_y(waist),
+        'hip_y': to_y(hip),
+        'center_x': int(round((left + center) * scale)),
+        'torso_width': int(round(widths[shoulder] * scale)),
+        'hip_width': int(round(widths[hip] * scale)),
+    }
+
+
+class LandmarkEstimator:
+    """Thread-safe LRU cache of estimate_landmarks results, keyed by image content"""
+
+    def __init__(self, max_entries=64, metrics=None):
+        self.max_entries = max_entries
+        self.metrics = metrics or METRICS
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def estimate(self, image):
+        """Return the landmarks for image (or None), estimating them only once per image"""
+        key = image_digest(image)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        with self.metrics.span('stage_seconds', stage='landmarks'):
+            landmarks = estimate_landmarks(image)
+
+        with self._lock:
+            self._entries[key] = landmarks
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return landmarks
+
+
+# Process-wide estimator, so every synthesizer shares one cache
+LANDMARKS = LandmarkEstimator()
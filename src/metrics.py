@@ -0,0 +1,169 @@
+"""
+In-process runtime metrics: counters and latency histograms fed by timing
+spans around the pipeline stages, exportable as Prometheus text or JSON.
+
+Components record into the process-wide METRICS registry unless they are
+given their own.
+"""
+
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(key, value.replace('\\', '\\\\').replace('"', '\\"'))
+        for key, value in pairs
+    ) + '}'
+
+
+class Histogram:
+    """Count and sum of all observations, with quantiles over a recent window"""
+
+    def __init__(self, window=1024):
+        self.count = 0
+        self.total = 0.0
+        self._window = deque(maxlen=window)
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self._window.append(value)
+
+    def quantile(self, q):
+        """Return the q-quantile of the recent window, or None if nothing was observed"""
+        samples = sorted(self._window)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class MetricsRegistry:
+    """Thread-safe registry of labelled counters and histograms"""
+
+    def __init__(self, namespace='dress', window=1024):
+        self.namespace = namespace
+        self.window = window
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, amount=1, **labels):
+        """Add amount to a counter"""
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        """Record one observation in a histogram"""
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.window)
+            histogram.observe(value)
+
+    @contextmanager
+    def span(self, name, **labels):
+        """Time the enclosed block into histogram name, in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def counter_value(self, name, **labels):
+        """Return a counter's value; with no labels, the sum over all label sets"""
+        with self._lock:
+            if labels:
+                return self._counters.get((name, _label_key(labels)), 0)
+            return sum(value for (key, _), value in self._counters.items() if key == name)
+
+    def quantile(self, name, q, **labels):
+        """Return a histogram quantile, or None if nothing was recorded"""
+        with self._lock:
+            histogram = self._histograms.get((name, _label_key(labels)))
+            return histogram.quantile(q) if histogram is not None else None
+
+    def ratio(self, name, numerator_labels, denominator_name=None):
+        """Return counter name{numerator_labels} over the total of denominator_name, or None"""
+        numerator = self.counter_value(name, **numerator_labels)
+        denominator = self.counter_value(denominator_name or name)
+        return numerator / denominator if denominator else None
+
+    def histogram_labels(self, name):
+        """Return the label dicts recorded for histogram name"""
+        with self._lock:
+            return [dict(labels) for key, labels in self._histograms if key == name]
+
+    def snapshot(self):
+        """Return every metric as plain data, ready for JSON"""
+        with self._lock:
+            counters = [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+            histograms = [
+                {
+                    'name': name,
+                    'labels': dict(labels),
+                    'count': histogram.count,
+                    'sum': histogram.total,
+                    'quantiles': {str(q): histogram.quantile(q) for q in QUANTILES},
+                }
+                for (name, labels), histogram in sorted(self._histograms.items())
+            ]
+        return {'counters': counters, 'histograms': histograms}
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        prefix = f"{self.namespace}_" if self.namespace else ''
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+
+            typed = set()
+            for (name, labels), value in counters:
+                metric = prefix + name
+                if metric not in typed:
+                    typed.add(metric)
+                    lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric}{_format_labels(labels)} {value}")
+
+            for (name, labels), histogram in histograms:
+                metric = prefix + name
+                if metric not in typed:
+                    typed.add(metric)
+                    lines.append(f"# TYPE {metric} summary")
+                for q in QUANTILES:
+                    value = histogram.quantile(q)
+                    lines.append(f"{metric}{_format_labels(labels, [('quantile', str(q))])} {value}")
+                lines.append(f"{metric}_sum{_format_labels(labels)} {histogram.total}")
+                lines.append(f"{metric}_count{_format_labels(labels)} {histogram.count}")
+
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+# Process-wide registry shared by the app, the batch tools and the service
+METRICS = MetricsRegistry()
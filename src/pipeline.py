@@ -0,0 +1,312 @@
+"""
+Staged try-on pipeline for one node serving many requests.
+
+A try-on is split into four stages joined by bounded queues:
+
+- decode: load and preprocess both uploads (CPU, process pool)
+- analyze: the model calls, via DressSynthesizer.plan_try_on (I/O, threads)
+- render: fit, composite and effects, via DressSynthesizer.render_try_on (CPU, process pool)
+- encode: PNG encoding of the result (CPU, process pool)
+
+CPU stages hand pixel buffers to and from the worker processes in shared
+memory, so only a segment name and a shape are pickled, never the frames.
+Requests waiting on the API hold an analyze thread, not a core, so the
+process pool keeps rendering while they wait. A full queue blocks the stage
+feeding it, which pushes back all the way to submit().
+"""
+
+import concurrent.futures
+import io
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+
+from PIL import Image
+import numpy as np
+
+from .dress_synthesizer import DressSynthesizer
+from .image_utils import ImageProcessor
+from .metrics import METRICS, MetricsRegistry
+
+STAGES = ('decode', 'analyze', 'render', 'encode')
+
+
+class InvalidImage(ValueError):
+    """Raised when an upload cannot be decoded; the message names the upload"""
+
+
+class SharedFrame:
+    """
+    An RGB uint8 frame in a shared memory segment. Pickles as its segment name
+    and shape, so passing it to a worker process copies no pixels. The segment
+    lives until release() is called in any process.
+    """
+
+    def __init__(self, name, shape):
+        self.name = name
+        self.shape = tuple(shape)
+        self._shm = None
+
+    @classmethod
+    def from_image(cls, image):
+        """Copy a PIL image into a new shared memory segment"""
+        pixels = np.asarray(image if image.mode == 'RGB' else image.convert('RGB'))
+        shm = shared_memory.SharedMemory(create=True, size=max(1, pixels.nbytes))
+        np.ndarray(pixels.shape, np.uint8, buffer=shm.buf)[...] = pixels
+        frame = cls(shm.name, pixels.shape)
+        frame._shm = shm
+        return frame
+
+    def __getstate__(self):
+        return {'name': self.name, 'shape': self.shape}
+
+    def __setstate__(self, state):
+        self.__init__(state['name'], state['shape'])
+
+    def _segment(self):
+        if self._shm is None:
+            self._shm = shared_memory.SharedMemory(name=self.name)
+        return self._shm
+
+    def to_image(self):
+        """Return a PIL copy of the frame"""
+        pixels = np.ndarray(self.shape, np.uint8, buffer=self._segment().buf)
+        image = Image.fromarray(pixels)
+        del pixels  # The segment cannot be closed while a view is exported
+        return image
+
+    def close(self):
+        """Detach this process from the segment, leaving it for other processes"""
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+
+    def release(self):
+        """Free the segment; the frame cannot be read afterwards, in any process"""
+        shm = self._segment()
+        self._shm = None
+        shm.close()
+        shm.unlink()
+
+
+_WORKER_COMPONENTS = {}
+_WORKER_LOCK = threading.Lock()
+
+
+def _worker_components(quality):
+    """
+    Return this worker's (ImageProcessor, DressSynthesizer) for a quality.
+    The synthesizer has no model and its own metrics: the pipeline counts
+    results in the caller's registry.
+    """
+    with _WORKER_LOCK:
+        components = _WORKER_COMPONENTS.get(quality)
+        if components is None:
+            metrics = MetricsRegistry()
+            components = _WORKER_COMPONENTS[quality] = (
+                ImageProcessor(quality=quality, metrics=metrics),
+                DressSynthesizer(None, quality=quality, metrics=metrics),
+            )
+        return components
+
+
+def decode_uploads(quality, person, dress):
+    """Worker task: load and preprocess both uploads; returns (human, dress) frames"""
+    image_processor, _ = _worker_components(quality)
+    frames = []
+    try:
+        for label, data, purpose in (('person', person, 'human'), ('dress', dress, 'dress')):
+            image, message = image_processor.load_image(io.BytesIO(data), purpose=purpose)
+            if image is None:
+                raise InvalidImage(f"{label}: {message}")
+            if purpose == 'human':
+                image = image_processor.preprocess_human_image(image)
+            else:
+                image = image_processor.preprocess_dress_image(image)
+            frames.append(SharedFrame.from_image(image))
+    except Exception:
+        for frame in frames:
+            frame.release()
+        raise
+    for frame in frames:
+        frame.close()
+    return tuple(frames)
+
+
+def render_frames(quality, human_frame, dress_frame, plan):
+    """Worker task: render a plan; returns (result frame, error)"""
+    _, synthesizer = _worker_components(quality)
+    human_image, dress_image = human_frame.to_image(), dress_frame.to_image()
+    human_frame.close()
+    dress_frame.close()
+    result_image, error = synthesizer.render_try_on(human_image, dress_image, plan)
+    frame = SharedFrame.from_image(result_image)
+    frame.close()
+    return frame, error
+
+
+def encode_png(frame):
+    """Worker task: return a frame encoded as PNG bytes"""
+    image = frame.to_image()
+    frame.close()
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def _start_worker():
+    """Worker task run once per process on start, so the first request pays no imports"""
+    return os.getpid()
+
+
+class TryOnPipeline:
+    """
+    Runs try-ons through the decode, analyze, render and encode stages. Each
+    stage is a set of threads reading a bounded queue: CPU stages dispatch to
+    the shared process pool, the analyze stage makes the model calls itself.
+    Requests carry their own synthesizer, so one pipeline serves every
+    quality and analysis mode.
+    """
+
+    def __init__(self, cpu_workers=None, io_workers=16, queue_size=16, metrics=None, executor=None):
+        self.cpu_workers = cpu_workers or os.cpu_count() or 1
+        self.io_workers = io_workers  # Requests that may wait on the model at once
+        self.metrics = metrics or METRICS
+        # Any concurrent.futures executor works; a thread pool keeps everything in-process
+        self._executor = executor
+        self._owns_executor = executor is None
+        self._queues = {stage: queue.Queue(maxsize=queue_size) for stage in STAGES}
+        self._threads = {stage: [] for stage in STAGES}
+
+    def start(self):
+        if self._executor is None:
+            # Spawned workers: forking a process that is already running threads is unsafe
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.cpu_workers, mp_context=multiprocessing.get_context('spawn')
+            )
+        concurrent.futures.wait([self._executor.submit(_start_worker) for _ in range(self.cpu_workers)])
+
+        handlers = {
+            'decode': self._decode,
+            'analyze': self._analyze,
+            'render': self._render,
+            'encode': self._encode,
+        }
+        for index, stage in enumerate(STAGES):
+            next_stage = STAGES[index + 1] if index + 1 < len(STAGES) else None
+            count = self.io_workers if stage == 'analyze' else self.cpu_workers
+            for number in range(count):
+                thread = threading.Thread(
+                    target=self._run_stage, args=(stage, handlers[stage], next_stage),
+                    name=f'pipeline-{stage}-{number}', daemon=True
+                )
+                thread.start()
+                self._threads[stage].append(thread)
+
+    def close(self):
+        """Finish every submitted request, then stop the stages and the process pool"""
+        # Stages stop in order, so each one drains before the next gets its sentinels
+        for stage in STAGES:
+            for _ in self._threads[stage]:
+                self._queues[stage].put(None)
+            for thread in self._threads[stage]:
+                thread.join()
+            self._threads[stage] = []
+        if self._owns_executor and self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def queue_depths(self):
+        return {stage: self._queues[stage].qsize() for stage in STAGES}
+
+    def submit(self, synthesizer, person, dress, keep_inputs=False, timeout=None):
+        """
+        Queue a try-on of two uploads (encoded image bytes). Blocks while the
+        decode queue is full; raises queue.Full if timeout runs out first.
+        Returns a Future for a dict with 'image', 'png', 'error' and 'path',
+        plus the preprocessed 'human' and 'dress' images if keep_inputs.
+        """
+        future = concurrent.futures.Future()
+        job = {
+            'future': future,
+            'synthesizer': synthesizer,
+            'person': person,
+            'dress': dress,
+            'keep_inputs': keep_inputs,
+            'frames': (),
+            'result': None,
+        }
+        self._put('decode', job, timeout)
+        return future
+
+    def _put(self, stage, job, timeout=None):
+        job['queued_at'] = time.perf_counter()
+        self._queues[stage].put(job, timeout=timeout)
+
+    def _run_stage(self, stage, handler, next_stage):
+        inbox = self._queues[stage]
+        while True:
+            job = inbox.get()
+            if job is None:
+                return
+            self.metrics.observe('pipeline_queue_seconds', time.perf_counter() - job['queued_at'], stage=stage)
+            if stage == STAGES[0] and not job['future'].set_running_or_notify_cancel():
+                continue  # The caller gave up while the request was queued
+
+            try:
+                with self.metrics.span('pipeline_stage_seconds', stage=stage):
+                    handler(job)
+            except Exception as e:
+                self._release(job)
+                job['future'].set_exception(e)
+                continue
+
+            if next_stage is not None:
+                self._put(next_stage, job)
+
+    def _release(self, job):
+        for frame in job['frames'] + ((job['result'],) if job['result'] is not None else ()):
+            frame.release()
+        job['frames'], job['result'] = (), None
+
+    def _decode(self, job):
+        quality = job['synthesizer'].quality
+        job['frames'] = self._executor.submit(decode_uploads, quality, job['person'], job['dress']).result()
+        job['person'] = job['dress'] = None  # The uploads are not needed past this stage
+
+    def _analyze(self, job):
+        human_image, dress_image = (frame.to_image() for frame in job['frames'])
+        job['plan'] = job['synthesizer'].plan_try_on(human_image, dress_image)
+        if job['keep_inputs']:
+            job['inputs'] = {'human': human_image, 'dress': dress_image}
+
+    def _render(self, job):
+        synthesizer = job['synthesizer']
+        human_frame, dress_frame = job['frames']
+        job['result'], job['error'] = self._executor.submit(
+            render_frames, synthesizer.quality, human_frame, dress_frame, job['plan']
+        ).result()
+        for frame in job['frames']:
+            frame.release()
+        job['frames'] = ()
+        # The worker counted into its own registry; count here where it is exported
+        job['path'] = 'fallback' if job['error'] else job['plan']['path']
+        synthesizer._count_result(job['path'])
+
+    def _encode(self, job):
+        png = self._executor.submit(encode_png, job['result']).result()
+        image = job['result'].to_image()
+        self._release(job)
+        result = {'image': image, 'png': png, 'error': job['error'], 'path': job['path']}
+        result.update(job.get('inputs', {}))
+        job['future'].set_result(result)
@@ -0,0 +1,56 @@
+"""
+Processing profiles behind the "Output Quality" option.
+
+- Fast: no model call, smaller working size and bilinear resampling
+- Balanced: the standard AI-guided pipeline
+- High Quality: the full pipeline at a larger working size
+- Print: a 2048x3072 render for print and zoom; images sent to the model are
+  capped at model_max_side, and enhancement and compositing run in row bands
+"""
+
+DEFAULT_QUALITY = "Balanced"
+
+QUALITY_PROFILES = {
+    "Fast": {
+        'target_size': (384, 576),
+        'dress_box': (300, 450),
+        'resample': 'BILINEAR',
+        'use_model': False,
+        'enhance': False,
+    },
+    "Balanced": {
+        'target_size': (512, 768),
+        'dress_box': (400, 600),
+        'resample': 'LANCZOS',
+        'use_model': True,
+        'enhance': True,
+    },
+    "High Quality": {
+        'target_size': (768, 1152),
+        'dress_box': (600, 900),
+        'resample': 'LANCZOS',
+        'use_model': True,
+        'enhance': True,
+    },
+    "Print": {
+        'target_size': (2048, 3072),
+        'dress_box': (1600, 2400),
+        'resample': 'LANCZOS',
+        'use_model': True,
+        'enhance': True,
+        'model_max_side': 1152,  # The analysis gains nothing from print resolution
+    },
+}
+
+
+def get_quality_profile(quality):
+    """Return the processing profile for a quality name, defaulting to Balanced"""
+    return QUALITY_PROFILES.get(quality, QUALITY_PROFILES[DEFAULT_QUALITY])
+
+
+def resample_filter(profile):
+    """Return the PIL resampling filter for a profile"""
+    # Profiles name their filter so the UI can list them without importing Pillow
+    from PIL import Image
+
+    return getattr(Image.Resampling, profile['resample'])
@@ -0,0 +1,358 @@
+"""
+Resilience layer for model calls: per-request latency budgets, jittered
+retries for transient errors, hedged duplicate requests past the observed
+p95 latency, and a circuit breaker that fails fast while the API is degraded.
+"""
+
+import asyncio
+import concurrent.futures
+import random
+import threading
+import time
+from collections import deque
+
+# google.api_core exception names that indicate a transient failure
+RETRYABLE_ERROR_NAMES = {
+    'DeadlineExceeded',
+    'InternalServerError',
+    'ResourceExhausted',
+    'ServiceUnavailable',
+    'TooManyRequests',
+    'GatewayTimeout',
+    'BadGateway',
+}
+
+# How often a sync call with an attempt still queued locally checks whether it has started
+QUEUE_POLL_SECONDS = 0.05
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the model while the circuit breaker is open"""
+
+
+class DeadlineExceededError(TimeoutError):
+    """Raised when a call does not finish within its latency budget"""
+
+
+class QueueTimeoutError(DeadlineExceededError):
+    """Raised when the budget runs out before a call leaves the local executor queue"""
+
+
+def is_retryable(error):
+    """Return True for errors worth retrying: timeouts, connection and 429/5xx errors"""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return type(error).__name__ in RETRYABLE_ERROR_NAMES
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies, in seconds"""
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def quantile(self, q):
+        """Return the q-quantile of the window, or None if it is empty"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(q * len(samples)))
+        return samples[index]
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive transient failures. While open
+    every call fails fast; after reset_timeout one trial call is let through
+    (half-open) and its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if self.clock() - self._opened_at >= self.reset_timeout:
+                return 'half-open'
+            return 'open'
+
+    def allow(self):
+        """Return True if a call may go ahead now"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self.clock() - self._opened_at < self.reset_timeout or self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                self._opened_at = self.clock()
+            self._trial_running = False
+
+    def release(self):
+        """End a call that says nothing about API health, leaving the state as it was"""
+        with self._lock:
+            self._trial_running = False
+
+
+class ResiliencePolicy:
+    """
+    Runs model calls under a latency budget. A call is a function taking the
+    remaining timeout in seconds (sync) or a coroutine function taking the
+    same (async); it is retried with jittered exponential backoff on transient
+    errors and hedged with a duplicate request once it runs past the hedge
+    threshold. Sync calls run on a shared executor; call_timeout and the
+    latency window count from when an attempt starts running, so time queued
+    locally only spends the request budget and never trips the breaker.
+    Share one policy across requests so the breaker and latency window see
+    all traffic.
+    """
+
+    def __init__(self, request_budget=45.0, call_timeout=25.0, max_attempts=3,
+                 base_delay=0.5, max_delay=4.0, hedge=True, hedge_quantile=0.95,
+                 hedge_min_samples=20, breaker=None, latency=None, max_workers=8):
+        self.request_budget = request_budget  # Seconds for one user request end to end
+        self.call_timeout = call_timeout  # Seconds for a single model call
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples  # No hedging until p95 is meaningful
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = latency or LatencyTracker()
+        self.max_workers = max_workers
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self.retries = 0
+        self.hedges = 0
+
+    def new_deadline(self):
+        """Return the absolute deadline for a request starting now"""
+        return time.monotonic() + self.request_budget
+
+    def available(self):
+        """Return False while the circuit breaker is rejecting calls"""
+        return self.breaker.state != 'open'
+
+    def hedge_delay(self):
+        """Seconds after which a duplicate request is sent, or None if hedging is off"""
+        if not self.hedge or len(self.latency) < self.hedge_min_samples:
+            return None
+        return self.latency.quantile(self.hedge_quantile)
+
+    def call(self, fn, deadline=None):
+        """Run fn(timeout) with retries, hedging and the circuit breaker"""
+        if deadline is None:
+            deadline = self.new_deadline()
+        for attempt in range(self.max_attempts):
+            self._check_breaker()
+            try:
+                result = self._hedged_call(fn, deadline)
+            except Exception as e:
+                self._handle_failure(e, attempt, deadline)
+                time.sleep(self._backoff(attempt, deadline))
+                continue
+            except BaseException:
+                # Interrupted without an outcome; don't hold a half-open trial slot forever
+                self.breaker.release()
+                raise
+            self.breaker.record_success()
+            return result
+
+    async def call_async(self, fn, deadline=None):
+        """Async variant of call; fn(timeout) must return an awaitable"""
+        if deadline is None:
+            deadline = self.new_deadline()
+        for attempt in range(self.max_attempts):
+            self._check_breaker()
+            try:
+                result = await self._hedged_call_async(fn, deadline)
+            except Exception as e:
+                self._handle_failure(e, attempt, deadline)
+                await asyncio.sleep(self._backoff(attempt, deadline))
+                continue
+            except BaseException:
+                # Cancelled without an outcome; don't hold a half-open trial slot forever
+                self.breaker.release()
+                raise
+            self.breaker.record_success()
+            return result
+
+    def guard(self):
+        """Check the breaker for calls run outside call(), such as streams"""
+        self._check_breaker()
+
+    def record(self, error=None):
+        """Report the outcome of a call run outside call()"""
+        if error is None:
+            self.breaker.record_success()
+        elif is_retryable(error):
+            self.breaker.record_failure()
+        else:
+            self.breaker.release()
+
+    def release(self):
+        """Report that a call run outside call() ended with no outcome, such as an abandoned stream"""
+        self.breaker.release()
+
+    def _check_breaker(self):
+        if not self.breaker.allow():
+            raise CircuitOpenError("Model API is degraded; circuit breaker is open")
+
+    def _handle_failure(self, error, attempt, deadline):
+        """Re-raise unless error is transient and there is budget for another attempt"""
+        if isinstance(error, QueueTimeoutError) or not is_retryable(error):
+            # Local queueing and bad requests say nothing about API health
+            self.breaker.release()
+            raise error
+        self.breaker.record_failure()
+        if attempt + 1 >= self.max_attempts or time.monotonic() >= deadline:
+            raise error
+        self.retries += 1
+
+    def _backoff(self, attempt, deadline):
+        """Full-jitter exponential backoff, never sleeping past the deadline"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return max(0.0, min(delay, deadline - time.monotonic()))
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix='model-call'
+                )
+            return self._executor
+
+    def _hedged_call(self, fn, deadline):
+        executor = self._get_executor()
+        started = {}  # future -> when it started running, set from the worker thread
+
+        def submit():
+            future = None
+            ready = threading.Event()
+
+            def run():
+                ready.wait()
+                begin = started[future] = time.monotonic()
+                return fn(min(deadline, begin + self.call_timeout) - begin)
+
+            future = executor.submit(run)
+            ready.set()
+            return future
+
+        primary = submit()
+        pending = {primary}
+        hedge_delay = self.hedge_delay()
+        error = None
+
+        while pending:
+            now = time.monotonic()
+            begins = [started.get(future) for future in pending]
+            if None in begins:
+                limit = deadline  # An attempt is still queued locally; only the request budget applies
+            else:
+                limit = min(deadline, max(begins) + self.call_timeout)
+            remaining = limit - now
+            if remaining <= 0:
+                for future in pending:
+                    future.cancel()  # Frees slots still queued; running attempts cannot be stopped
+                if not any(begins):
+                    raise QueueTimeoutError("Model call budget ran out while queued for an executor slot")
+                raise DeadlineExceededError("Model call exceeded its latency budget")
+            wait = remaining if None not in begins else min(remaining, QUEUE_POLL_SECONDS)
+            primary_begin = started.get(primary)
+            if hedge_delay is not None:
+                # The hedge clock starts when the primary starts running, not when it is queued
+                if primary_begin is not None:
+                    wait = min(wait, max(0.0, primary_begin + hedge_delay - now))
+
+            done, pending = concurrent.futures.wait(
+                pending, timeout=wait, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                if future.exception() is None:
+                    # Losing requests cannot be cancelled mid-flight; their results are dropped
+                    self.latency.record(time.monotonic() - started[future])
+                    return future.result()
+                error = future.exception()
+
+            if (hedge_delay is not None and not done and primary_begin is not None and
+                    time.monotonic() >= primary_begin + hedge_delay):
+                hedge_delay = None
+                self.hedges += 1
+                pending.add(submit())
+
+        raise error
+
+    async def _hedged_call_async(self, fn, deadline):
+        started = {}  # task -> when it started; tasks start running as soon as they are created
+
+        def submit():
+            begin = time.monotonic()
+            task = asyncio.ensure_future(fn(min(deadline, begin + self.call_timeout) - begin))
+            started[task] = begin
+            return task
+
+        primary = submit()
+        pending = {primary}
+        hedge_delay = self.hedge_delay()
+        error = None
+
+        try:
+            while pending:
+                now = time.monotonic()
+                limit = min(deadline, max(started[task] for task in pending) + self.call_timeout)
+                remaining = limit - now
+                if remaining <= 0:
+                    raise DeadlineExceededError("Model call exceeded its latency budget")
+                wait = remaining
+                if hedge_delay is not None:
+                    wait = min(remaining, max(0.0, started[primary] + hedge_delay - now))
+
+                done, pending = await asyncio.wait(
+                    pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        self.latency.record(time.monotonic() - started[task])
+                        return task.result()
+                    error = task.exception()
+
+                if hedge_delay is not None and not done:
+                    hedge_delay = None
+                    self.hedges += 1
+                    pending.add(submit())
+
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
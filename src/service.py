@@ -0,0 +1,431 @@
+"""
+Standalone HTTP try-on service.
+
+    python -m src.service --port 8080 --workers 4 --queue-size 16
+    python -m src.service --stub            # offline, with the fake model
+
+Endpoints:
+- POST /v1/try-on: multipart form with "person" and "dress" image files and
+  optional "quality", "analysis_mode", "include_analysis" and "format" fields.
+  Returns JSON (the result as base64 PNG) or, with format=png, the PNG itself.
+- GET /healthz: the process is up
+- GET /readyz: workers are running and the queue has room (503 otherwise)
+- GET /metrics: Prometheus text; /metrics?format=json for JSON
+
+Requests wait in a bounded queue for a fixed pool of workers. When the queue
+is full the service answers 429 with a Retry-After estimate instead of
+letting latency grow without bound.
+
+With --cpu-workers N, workers hand each try-on to a staged pipeline
+(src/pipeline.py): image work runs on N processes while the workers wait on
+the model, so --workers can be raised well past the core count.
+"""
+
+import argparse
+import base64
+import concurrent.futures
+import email.parser
+import email.policy
+import io
+import json
+import math
+import os
+import queue
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from .cache import ResultCache
+from .dress_synthesizer import DressSynthesizer
+from .image_utils import ImageProcessor
+from .metrics import METRICS
+from .pipeline import InvalidImage, TryOnPipeline
+from .quality import DEFAULT_QUALITY, QUALITY_PROFILES
+from .resilience import ResiliencePolicy
+
+ANALYSIS_MODES = ('standard', 'fused', 'split')
+MAX_BODY_BYTES = 25 * 1024 * 1024  # Two uploads at ImageProcessor's 10MB limit, plus form overhead
+
+
+class ServiceSaturated(Exception):
+    """Raised when the request queue is full"""
+
+    def __init__(self, retry_after):
+        super().__init__("Try-on queue is full")
+        self.retry_after = retry_after
+
+
+class InvalidRequest(Exception):
+    """Raised for requests the service cannot process; reported as 400"""
+
+
+class TryOnService:
+    """
+    Bounded queue in front of a fixed pool of worker threads. Synthesizers are
+    created per (quality, analysis mode) and share one cache, resilience policy
+    and metrics registry. With cpu_workers, image work runs in a TryOnPipeline
+    process pool of that size instead of on the worker threads.
+    """
+
+    def __init__(self, model, workers=4, queue_size=16, cache=None, resilience=None,
+                 metrics=None, request_timeout=60.0, cpu_workers=0):
+        self.model = model
+        self.workers = workers
+        self.cache = cache
+        # Every worker may wait on one model call plus its hedge
+        self.resilience = resilience or ResiliencePolicy(max_workers=2 * workers)
+        self.metrics = metrics or METRICS
+        self.request_timeout = request_timeout  # Seconds a caller waits, queueing included
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._synthesizers = {}
+        self._synthesizers_lock = threading.Lock()
+        self._threads = []
+        self._busy = 0
+        self._busy_lock = threading.Lock()
+        self._job_seconds = 2.0  # Moving average used for Retry-After; refined as jobs finish
+        self._accepting = False
+        self.pipeline = None
+        if cpu_workers:
+            self.pipeline = TryOnPipeline(
+                cpu_workers=cpu_workers, io_workers=workers, queue_size=queue_size, metrics=self.metrics
+            )
+
+    def start(self):
+        if self.pipeline is not None:
+            self.pipeline.start()
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'tryon-worker-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self._accepting = True
+
+    def close(self):
+        """Stop taking requests and let the workers finish what is queued"""
+        self._accepting = False
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        if self.pipeline is not None:
+            self.pipeline.close()
+
+    @property
+    def ready(self):
+        return (self._accepting and not self._queue.full() and
+                all(thread.is_alive() for thread in self._threads))
+
+    def status(self):
+        with self._busy_lock:
+            busy = self._busy
+        status = {
+            'ready': self.ready,
+            'workers': self.workers,
+            'busy_workers': busy,
+            'queued': self._queue.qsize(),
+            'queue_size': self._queue.maxsize,
+            'circuit': self.resilience.breaker.state,
+        }
+        if self.pipeline is not None:
+            status['pipeline_queued'] = self.pipeline.queue_depths()
+        return status
+
+    def retry_after(self):
+        """Seconds until a queue slot is likely to free up"""
+        backlog = self._queue.qsize() + 1
+        return max(1, math.ceil(self._job_seconds * backlog / self.workers))
+
+    def submit(self, job):
+        """Queue a job dict; returns a Future, or raises ServiceSaturated"""
+        if not self._accepting:
+            raise ServiceSaturated(self.retry_after())
+        future = concurrent.futures.Future()
+        try:
+            self._queue.put_nowait((job, future, time.perf_counter()))
+        except queue.Full:
+            self.metrics.inc('service_rejected_total')
+            raise ServiceSaturated(self.retry_after())
+        return future
+
+    def _synthesizer(self, quality, analysis_mode):
+        key = (quality, analysis_mode)
+        with self._synthesizers_lock:
+            synthesizer = self._synthesizers.get(key)
+            if synthesizer is None:
+                synthesizer = DressSynthesizer(
+                    self.model,
+                    cache=self.cache,
+                    analysis_mode=analysis_mode,
+                    max_concurrency=self.workers,
+                    quality=quality,
+                    resilience=self.resilience,
+                    metrics=self.metrics
+                )
+                self._synthesizers[key] = synthesizer
+            return synthesizer
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            job, future, queued_at = item
+            self.metrics.observe('service_queue_seconds', time.perf_counter() - queued_at)
+            if not future.set_running_or_notify_cancel():
+                continue  # The caller gave up while the job was queued
+
+            with self._busy_lock:
+                self._busy += 1
+            started = time.perf_counter()
+            try:
+                future.set_result(self.process(job))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                elapsed = time.perf_counter() - started
+                self._job_seconds = 0.8 * self._job_seconds + 0.2 * elapsed
+                with self._busy_lock:
+                    self._busy -= 1
+
+    def process(self, job):
+        """Run one try-on; returns a dict with the result image and any analysis"""
+        synthesizer = self._synthesizer(job['quality'], job['analysis_mode'])
+        if self.pipeline is not None:
+            return self._process_staged(job, synthesizer)
+
+        image_processor = ImageProcessor(quality=job['quality'], metrics=self.metrics)
+        human_image, message = image_processor.load_image(io.BytesIO(job['person']), purpose='human')
+        if human_image is None:
+            raise InvalidRequest(f"person: {message}")
+        dress_image, message = image_processor.load_image(io.BytesIO(job['dress']), purpose='dress')
+        if dress_image is None:
+            raise InvalidRequest(f"dress: {message}")
+
+        human_image = image_processor.preprocess_human_image(human_image)
+        dress_image = image_processor.preprocess_dress_image(dress_image)
+
+        result_image, error = synthesizer.generate_try_on_checked(human_image, dress_image)
+        result = {'image': result_image, 'error': error}
+        if job['include_analysis'] and QUALITY_PROFILES[job['quality']]['use_model']:
+            result['analysis'] = synthesizer.analyze_compatibility(human_image, dress_image)
+            result['suggestions'] = synthesizer.get_styling_suggestions(human_image, dress_image)
+        return result
+
+    def _process_staged(self, job, synthesizer):
+        """process() through the pipeline; the result also carries the encoded PNG"""
+        include_analysis = job['include_analysis'] and QUALITY_PROFILES[job['quality']]['use_model']
+        try:
+            result = self.pipeline.submit(
+                synthesizer, job['person'], job['dress'], keep_inputs=include_analysis
+            ).result()
+        except InvalidImage as e:
+            raise InvalidRequest(str(e))
+        human_image, dress_image = result.pop('human', None), result.pop('dress', None)
+        if include_analysis:
+            result['analysis'] = synthesizer.analyze_compatibility(human_image, dress_image)
+            result['suggestions'] = synthesizer.get_styling_suggestions(human_image, dress_image)
+        return result
+
+
+def parse_multipart(content_type, body):
+    """Parse a multipart/form-data body into {field name: bytes}"""
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body
+    )
+    if not message.is_multipart():
+        raise InvalidRequest("Expected a multipart/form-data body")
+
+    fields = {}
+    for part in message.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+        if name:
+            fields[name] = part.get_payload(decode=True) or b''
+    return fields
+
+
+def build_job(fields):
+    """Validate form fields and return a job dict for TryOnService.submit"""
+    for name in ('person', 'dress'):
+        if not fields.get(name):
+            raise InvalidRequest(f"Missing '{name}' image file")
+
+    def text(name, default):
+        return fields[name].decode('utf-8').strip() if name in fields else default
+
+    quality = text('quality', DEFAULT_QUALITY)
+    if quality not in QUALITY_PROFILES:
+        raise InvalidRequest(f"Unknown quality '{quality}'; expected one of {list(QUALITY_PROFILES)}")
+    analysis_mode = text('analysis_mode', 'fused')
+    if analysis_mode not in ANALYSIS_MODES:
+        raise InvalidRequest(f"Unknown analysis_mode '{analysis_mode}'")
+    response_format = text('format', 'json')
+    if response_format not in ('json', 'png'):
+        raise InvalidRequest("format must be 'json' or 'png'")
+
+    return {
+        'person': fields['person'],
+        'dress': fields['dress'],
+        'quality': quality,
+        'analysis_mode': analysis_mode,
+        'include_analysis': text('include_analysis', 'false').lower() in ('1', 'true', 'yes'),
+        'format': response_format,
+    }
+
+
+class TryOnRequestHandler(BaseHTTPRequestHandler):
+    """Routes HTTP requests to the TryOnService attached to the server"""
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'DressTryOn/1.0'
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/healthz':
+            self._send_json(200, {'status': 'ok'})
+        elif url.path == '/readyz':
+            status = self.service.status()
+            self._send_json(200 if status['ready'] else 503, status)
+        elif url.path == '/metrics':
+            if parse_qs(url.query).get('format') == ['json']:
+                self._send(200, self.service.metrics.to_json().encode('utf-8'), 'application/json')
+            else:
+                self._send(200, self.service.metrics.to_prometheus().encode('utf-8'),
+                           'text/plain; version=0.0.4')
+        else:
+            self._send_json(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/v1/try-on':
+            self._send_json(404, {'error': 'Not found'})
+            return
+
+        started = time.perf_counter()
+        status = self._handle_try_on()
+        self.service.metrics.inc('service_requests_total', status=status)
+        self.service.metrics.observe('service_request_seconds', time.perf_counter() - started)
+
+    def _handle_try_on(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY_BYTES:
+            self.close_connection = True
+            return self._send_json(413, {'error': f"Request body over {MAX_BODY_BYTES} bytes"})
+
+        try:
+            body = self.rfile.read(length)
+            job = build_job(parse_multipart(self.headers.get('Content-Type', ''), body))
+            future = self.service.submit(job)
+        except InvalidRequest as e:
+            return self._send_json(400, {'error': str(e)})
+        except ServiceSaturated as e:
+            return self._send_json(429, {'error': str(e), 'retry_after': e.retry_after},
+                                   {'Retry-After': str(e.retry_after)})
+
+        try:
+            result = future.result(timeout=self.service.request_timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            return self._send_json(504, {'error': "Try-on did not finish in time"})
+        except InvalidRequest as e:
+            return self._send_json(400, {'error': str(e)})
+        except Exception as e:
+            return self._send_json(500, {'error': f"Try-on failed: {e}"})
+
+        png = result.get('png')
+        if png is None:
+            buffer = io.BytesIO()
+            result['image'].save(buffer, format='PNG')
+            png = buffer.getvalue()
+        if job['format'] == 'png':
+            headers = {'X-Try-On-Error': result['error']} if result['error'] else None
+            return self._send(200, png, 'image/png', headers)
+
+        payload = {
+            'image': base64.b64encode(png).decode('ascii'),
+            'mime_type': 'image/png',
+            'width': result['image'].width,
+            'height': result['image'].height,
+            'error': result['error'],
+        }
+        for key in ('analysis', 'suggestions'):
+            if key in result:
+                payload[key] = result[key]
+        return self._send_json(200, payload)
+
+    def _send_json(self, status, payload, headers=None):
+        return self._send(status, json.dumps(payload).encode('utf-8'), 'application/json', headers)
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        return status
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+def create_server(service, host='127.0.0.1', port=8080, quiet=False):
+    """Return a ThreadingHTTPServer serving service; call serve_forever() to run it"""
+    server = ThreadingHTTPServer((host, port), TryOnRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    server.quiet = quiet
+    return server
+
+
+def main(argv=None):
+    from .batch import DEFAULT_MODEL, create_model
+
+    parser = argparse.ArgumentParser(description="HTTP virtual try-on service")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=4, help="Concurrent try-ons (default: 4)")
+    parser.add_argument('--cpu-workers', type=int, default=0,
+                        help="Processes for image work; 0 keeps it on the worker threads (default: 0)")
+    parser.add_argument('--queue-size', type=int, default=16,
+                        help="Requests allowed to wait for a worker before 429 (default: 16)")
+    parser.add_argument('--timeout', type=float, default=60.0,
+                        help="Seconds a request may take, queueing included (default: 60)")
+    parser.add_argument('--model', default=DEFAULT_MODEL, help=f"Gemini model (default: {DEFAULT_MODEL})")
+    parser.add_argument('--cache-dir', default=os.path.join('.cache', 'gemini'),
+                        help="Analysis result cache shared with the app")
+    parser.add_argument('--stub', action='store_true', help="Use the offline fake model instead of Gemini")
+    parser.add_argument('--stub-latency', type=float, default=0.0,
+                        help="Seconds each fake model call takes (default: 0)")
+    parser.add_argument('--quiet', action='store_true', help="Do not log each request")
+    args = parser.parse_args(argv)
+
+    service = TryOnService(
+        create_model(args),
+        workers=args.workers,
+        queue_size=args.queue_size,
+        cache=ResultCache(cache_dir=args.cache_dir),
+        request_timeout=args.timeout,
+        cpu_workers=args.cpu_workers
+    )
+    service.start()
+    server = create_server(service, args.host, args.port, args.quiet)
+    print(f"Serving try-ons on http://{args.host}:{args.port} "
+          f"({args.workers} workers, {args.cpu_workers or 'no'} CPU processes, queue of {args.queue_size})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -97,6 +97,69 @@ def test_streamlit_installation():
         print(f"❌ Streamlit - Error: {str(e)}")
         return False
 
+# (module, seconds allowed for a cold import, modules it must not pull in)
+IMPORT_BUDGETS = [
+    ('src.quality', 0.2, ['PIL', 'numpy', 'streamlit', 'google.generativeai']),
+    ('src.metrics', 0.2, ['PIL', 'numpy', 'streamlit', 'google.generativeai']),
+    ('src.styles', 0.2, ['PIL', 'numpy', 'streamlit', 'google.generativeai']),
+    ('src.dress_synthesizer', 1.5, ['streamlit', 'google.generativeai']),
+    ('src.batch', 1.5, ['streamlit', 'google.generativeai']),
+]
+
+# Modules app.py must not import at module level, so the UI shell renders first
+DEFERRED_APP_IMPORTS = ['google.generativeai', 'PIL', 'numpy', 'src.dress_synthesizer', 'src.image_utils']
+
+def test_import_budget():
+    """Test that cold imports stay light and within their time budgets"""
+    import ast
+    
+    print("\nTesting import-time budget...")
+    all_passed = True
+    
+    for module, budget, forbidden in IMPORT_BUDGETS:
+        # A fresh interpreter, so nothing is already imported
+        code = (
+            "import sys, time\n"
+            "start = time.perf_counter()\n"
+            f"import {module}\n"
+            "print(time.perf_counter() - start)\n"
+            f"print(','.join(name for name in {forbidden!r} if name in sys.modules))\n"
+        )
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, timeout=60)
+        if result.returncode != 0:
+            print(f"❌ {module} - Import failed: {result.stderr.strip().splitlines()[-1:]}")
+            all_passed = False
+            continue
+        
+        lines = result.stdout.splitlines()
+        seconds = float(lines[0])
+        loaded = lines[1] if len(lines) > 1 else ''
+        if loaded:
+            print(f"❌ {module} - Eagerly imports {loaded}")
+            all_passed = False
+        elif seconds > budget:
+            print(f"❌ {module} - {seconds:.2f}s, budget {budget:.2f}s")
+            all_passed = False
+        else:
+            print(f"✅ {module} - {seconds:.2f}s (budget {budget:.2f}s)")
+    
+    with open('app.py', 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    eager = set()
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            eager.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            eager.add(node.module)
+    deferred = [name for name in DEFERRED_APP_IMPORTS if name in eager]
+    if deferred:
+        print(f"❌ app.py - Imports {', '.join(deferred)} before the UI renders")
+        all_passed = False
+    else:
+        print("✅ app.py - Heavy modules are imported on first use")
+    
+    return all_passed
+
 def test_api_configuration():
     """Test API key configuration"""
     print("\nTesting API configuration...")
@@ -123,6 +186,7 @@ def main():
         test_package_imports,
         test_file_structure,
         test_streamlit_installation,
+        test_import_budget,
         test_api_configuration,
     ]
     